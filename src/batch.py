@@ -0,0 +1,93 @@
+import concurrent.futures
+import contextlib
+import glob
+import io
+import os
+import parallel
+import sys
+import time
+from parser import FileReader, Parser
+
+# Batch runner: many scripts are evaluated by a pool of processes. Each
+# worker imports the standard libraries once, when it starts, so that their
+# modules are in memory (see cache.load_module) and importing them again in
+# a script costs no parsing nor evaluation. Every script has its own Parser
+# and definitions, its output is captured and given back in the order of
+# the scripts.
+
+LIBRARIES = os.path.dirname(os.path.abspath(__file__))
+
+def scripts(patterns):
+    # paths and glob patterns, in the given order and without duplicates
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+def new_parser() -> Parser:
+    return Parser(dict(), set())
+
+def preload():
+    # run once by each worker. The libraries import each other by relative
+    # paths, they are imported from their directory as lcalc.py is run
+    cwd = os.getcwd()
+    try:
+        os.chdir(LIBRARIES)
+        for name in sorted(os.listdir(LIBRARIES)):
+            if name.endswith(".lc"):
+                try:
+                    new_parser().import_module(os.path.join(LIBRARIES, name))
+                except Exception as err:
+                    # the scripts still run, those importing it fail too
+                    print(f"Preloading {name} failed: {type(err).__name__}: {err}", file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+
+def run_script(path):
+    # returns (path, output, reductions, seconds, error)
+    P = new_parser()
+    output = io.StringIO()
+    error = None
+    start_time = time.time()
+    with contextlib.redirect_stdout(output):
+        try:
+            with open(path, "r") as f:
+                P.parse(FileReader(f))
+        except ValueError as err:
+            error = f"Bad expression: {err}"
+        except OSError as err:
+            error = str(err)
+        except SystemExit:
+            # exit; ends the script only
+            pass
+        except Exception as err:
+            # any other failure of a script is reported with it, the other
+            # scripts go on
+            error = f"{type(err).__name__}: {err}"
+        finally:
+            parallel.shutdown()
+    return (path, output.getvalue(), P.total_reductions, time.time()-start_time, error)
+
+def run(patterns, workers = None):
+    paths = scripts(patterns)
+    start_time = time.time()
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=preload) as pool:
+        results = list(pool.map(run_script, paths))
+    total_time = time.time()-start_time
+    failed = 0
+    for path, output, n, seconds, error in results:
+        print(f"===== {path} =====")
+        print(output, end="")
+        if error != None:
+            print(error)
+            failed += 1
+    print("----------- SUMMARY -----------")
+    for path, output, n, seconds, error in results:
+        status = "failed" if error != None else "ok"
+        print(f"{path}: {status}, {n} reductions in {seconds}s")
+    steps = sum(n for path, output, n, seconds, error in results)
+    print(f"{len(results)} scripts, {failed} failed, {steps} reductions, {total_time}s.")
+    return failed
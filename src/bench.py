@@ -0,0 +1,160 @@
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from parser import Parser, StringReader
+
+# Benchmark suite: each case is a script (imports, strategy, definitions)
+# followed by one term, whose evaluation is measured: number of reductions,
+# wall time, reductions per second, peak of traced memory and size of the
+# normal form. The time is the minimum of the repetitions, after a warm-up
+# run and with the garbage collector disabled: the noise of the machine only
+# ever adds time, and the repetitions of a case are spread over the run. The results are written as JSON and compared with the
+# results of a previous version: the reductions and the size must not
+# change, the time and the memory must not grow more than a tolerance and
+# more than MIN_SECONDS or MIN_BYTES.
+#
+# python bench.py [--quick] [--repeat n] [--out results.json]
+#                 [--baseline baseline.json] [--tolerance 1.0]
+
+LIBRARIES = os.path.dirname(os.path.abspath(__file__))
+
+RECURSIVE_FACT = "rfact := \\n. ifthenelse (iszero n) 1 (mult (rfact (pred n)) n);"
+
+# (name, setup, term), every case runs for a tenth of a second at least
+CASES = [
+    ("fact 5", 'import "numbers.lc";', "fact 5"),
+    ("fact 6", 'import "numbers.lc";', "fact 6"),
+    ("factp 6", 'import "numbers.lc";', "factp 6"),
+    ("factp 7", 'import "numbers.lc";', "factp 7"),
+    ("turingc rfact 5", 'import "numbers.lc"; import "combinators.lc"; defaultcombinator turingc; '+RECURSIVE_FACT, "rfact 5"),
+    ("curryc rfact 5", 'import "numbers.lc"; import "combinators.lc"; defaultcombinator curryc; '+RECURSIVE_FACT, "rfact 5"),
+    ("staticc rfact 5", 'import "numbers.lc"; import "combinators.lc"; defaultcombinator staticc; '+RECURSIVE_FACT, "rfact 5"),
+    ("add 2000 2000", 'import "numbers.lc";', "add 2000 2000"),
+    ("add 4000 4000", 'import "numbers.lc";', "add 4000 4000"),
+    ("mult 100 100", 'import "numbers.lc";', "mult 100 100"),
+    ("mult 200 200", 'import "numbers.lc";', "mult 200 200"),
+    ("exp 2 10", 'import "numbers.lc";', "exp 2 10"),
+    ("exp 2 12", 'import "numbers.lc";', "exp 2 12"),
+    ("sub 20 10", 'import "numbers.lc";', "sub 20 10"),
+    ("sub 30 15", 'import "numbers.lc";', "sub 30 15"),
+    ("proj 100 70", 'import "tuples.lc";', "proj 100 70 <"+",".join(str(i) for i in range(100))+">"),
+    ("proj 200 150", 'import "tuples.lc";', "proj 200 150 <"+",".join(str(i) for i in range(200))+">"),
+    ("addlist 60", 'import "lists.lc";', "addlist ["+",".join(str(i) for i in range(60))+"]"),
+    ("addlist 120", 'import "lists.lc";', "addlist ["+",".join(str(i) for i in range(120))+"]"),
+    ("eta both mult 60 60", 'import "numbers.lc"; reduce both;', "mult 60 60"),
+    ("eta both exp 2 10", 'import "numbers.lc"; reduce both;', "exp 2 10"),
+]
+
+# cases of the quick suite
+QUICK = ["fact 5", "factp 6", "turingc rfact 5", "curryc rfact 5", "staticc rfact 5", "add 2000 2000", "mult 100 100", "exp 2 10", "sub 20 10", "proj 100 70", "addlist 60", "eta both mult 60 60"]
+
+# growths below these are noise, whatever the tolerance
+MIN_SECONDS = 0.1
+MIN_BYTES = 65536
+
+def run_case(setup, expression, traced = False):
+    # returns (reductions, seconds, size of the normal form, peak in bytes)
+    P = Parser(dict(), set())
+    cwd = os.getcwd()
+    os.chdir(LIBRARIES)
+    try:
+        P.parse(StringReader(setup))
+        # the nodes left by the previous cases are neither counted nor
+        # collected during the evaluation
+        gc.collect()
+        if traced:
+            tracemalloc.start()
+        else:
+            gc.disable()
+        start_time = time.perf_counter()
+        P.parse(StringReader(f"benchmark_result := {expression};"))
+        seconds = time.perf_counter()-start_time
+        peak = None
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        gc.enable()
+        os.chdir(cwd)
+    return (P.last_reduction_number, seconds, P.free_vars["benchmark_result"][0].size, peak)
+
+def run(names = None, repeat = 5):
+    cases = [c for c in CASES if names == None or c[0] in names]
+    # warm-up: the libraries are loaded and the caches of the interpreter
+    # filled before the measures
+    for name, setup, expression in cases:
+        run_case(setup, expression)
+    # the repetitions go through all the cases in turn, so that a slow
+    # period of the machine does not hit every repetition of a case
+    times = {name: [] for name, setup, expression in cases}
+    for i in range(repeat):
+        for name, setup, expression in cases:
+            n, s, size, peak = run_case(setup, expression)
+            times[name].append(s)
+    results = {}
+    for name, setup, expression in cases:
+        # tracemalloc slows the evaluation down, the memory is measured apart
+        n, s, size, peak = run_case(setup, expression, True)
+        seconds = min(times[name])
+        results[name] = {
+            "reductions": n,
+            "seconds": seconds,
+            "reductions_per_second": n/seconds if seconds > 0 else None,
+            "peak_bytes": peak,
+            "size": size,
+        }
+        print(f"{name}: {n} reductions in {seconds:.4f}s, {results[name]['reductions_per_second'] or 0:.0f} reductions/s, peak of {peak} bytes, normal form of {size} nodes")
+    return results
+
+def compare(results, baseline, tolerance = 1.0):
+    # returns the list of regressions
+    regressions = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        b = baseline[name]
+        for key in ("reductions", "size"):
+            if r[key] != b[key]:
+                regressions.append(f"{name}: {key} changed from {b[key]} to {r[key]}")
+        for key, floor in (("seconds", MIN_SECONDS), ("peak_bytes", MIN_BYTES)):
+            if b[key] != None and r[key] != None and r[key] > b[key]*(1+tolerance) and r[key]-b[key] > floor:
+                regressions.append(f"{name}: {key} grew from {b[key]} to {r[key]} (+{round(100*(r[key]/b[key]-1), 1)}%)")
+    return regressions
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    names = None
+    repeat = 5
+    out = None
+    baseline = None
+    tolerance = 1.0
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "--quick":
+            names = QUICK
+        elif arg == "--repeat":
+            repeat = int(args.pop(0))
+        elif arg == "--out":
+            out = args.pop(0)
+        elif arg == "--baseline":
+            baseline = args.pop(0)
+        elif arg == "--tolerance":
+            tolerance = float(args.pop(0))
+        else:
+            sys.exit(f"Unknown argument {arg}.")
+
+    results = run(names, repeat)
+    if out != None:
+        with open(out, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+    if baseline != None:
+        with open(baseline, "r") as f:
+            regressions = compare(results, json.load(f)["results"], tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        print(f"{len(regressions)} regressions against {baseline}.")
+        sys.exit(1 if len(regressions) > 0 else 0)
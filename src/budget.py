@@ -0,0 +1,53 @@
+import time
+
+# Limits of an evaluation: number of reductions, seconds and number of
+# nodes (None when unlimited). The rewriting engine and the machine stop and
+# give the partially reduced term, the other engines raise BudgetExceeded.
+
+class BudgetExceeded(Exception):
+    pass
+
+class Counter:
+    # live objects of one evaluation, and their peak number: each object
+    # keeps the counter it was counted in, so the objects of an earlier
+    # evaluation freed during this one do not change it
+    def __init__(self) -> None:
+        self.live = 0
+        self.peak = 0
+
+    def add(self) -> None:
+        self.live += 1
+        if self.live > self.peak:
+            self.peak = self.live
+
+    def remove(self) -> None:
+        self.live -= 1
+
+class Budget:
+    def __init__(self, steps = None, seconds = None, nodes = None) -> None:
+        self.steps = steps
+        self.seconds = seconds
+        self.nodes = nodes
+        self.start = time.time()
+        # exhausted limit, once exceeded
+        self.reason = None
+
+    def exceeded(self, steps, nodes = None) -> bool:
+        if self.steps != None and steps >= self.steps:
+            self.reason = f"{self.steps} reductions"
+        elif self.nodes != None and nodes != None and nodes > self.nodes:
+            self.reason = f"{self.nodes} nodes"
+        elif self.seconds != None and time.time()-self.start >= self.seconds:
+            self.reason = f"{self.seconds}s"
+        return self.reason != None
+
+    def extend(self, budget):
+        # limits of self and budget added, for the engines which evaluate
+        # again from the start
+        def add(a, b):
+            return None if a == None or b == None else a+b
+        return Budget(add(self.steps, budget.steps), add(self.seconds, budget.seconds), add(self.nodes, budget.nodes))
+
+    def check(self, steps, nodes = None) -> None:
+        if self.exceeded(steps, nodes):
+            raise BudgetExceeded(steps)
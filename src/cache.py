@@ -0,0 +1,213 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import term
+
+# Least recently used cache of normal forms. Terms are hash-consed, so an
+# evaluated term is its own key: a lookup is a dictionary access, and the
+# entries keep their terms alive in the intern table. The size of the cache
+# is bounded by a number of entries and a number of nodes (the nodes of the
+# evaluated terms and of their normal forms).
+
+class NormalFormCache:
+    def __init__(self, max_entries = 1000, max_nodes = 1000000) -> None:
+        # {(mode, term): (normal form, reductions, stats)}
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mode, t: term.Term):
+        key = (mode, t)
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, mode, t: term.Term, value) -> None:
+        key = (mode, t)
+        nodes = t.size+value[0].size
+        if nodes > self.max_nodes or self.max_entries <= 0:
+            return
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = value
+        self.nodes += nodes
+        self.evict()
+
+    def remove(self, key) -> None:
+        value = self.entries.pop(key)
+        self.nodes -= key[1].size+value[0].size
+
+    def evict(self) -> None:
+        while len(self.entries) > self.max_entries or self.nodes > self.max_nodes:
+            self.remove(next(iter(self.entries)))
+
+    def set_limits(self, max_entries = None, max_nodes = None) -> None:
+        if max_entries != None:
+            self.max_entries = max_entries
+        if max_nodes != None:
+            self.max_nodes = max_nodes
+        self.evict()
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+
+# Import cache: what importing a module did is saved in a __lccache__
+# directory next to it, and replayed instead of parsing and evaluating the
+# module again as long as the module, the reduction mode, the fixed point
+# combinator and the definitions it used are unchanged. Each module has its
+# own record: the modules it imports are replayed from their own records,
+# so a module is cached once whatever was imported before it. Cache files
+# are JSON, reading one never runs code, and each mode has its own file.
+
+CACHE_DIR = "__lccache__"
+CACHE_VERSION = 5
+
+class ModuleRecord:
+    # what importing a module did, recorded while it is parsed
+    def __init__(self, path) -> None:
+        self.path = path
+        # only definitions and imports can be replayed
+        self.pure = True
+        # [("import", path as written, path it resolved to) |
+        # ("define", name, term, recursive ?)] in order
+        self.actions = []
+        # names whose value was defined by the module itself
+        self.defined = set()
+        # {name: (term, number of actions before its first use)} definitions
+        # of the importer and of the imported modules used by the module
+        self.external = {}
+
+    def define(self, name, t, recursive) -> None:
+        self.actions.append(("define", name, t, recursive))
+        self.defined.add(name)
+
+    def imported(self, written, path) -> None:
+        # the module may redefine names, their next uses are checked
+        self.actions.append(("import", written, path))
+        self.defined.clear()
+
+    def use(self, name, t) -> None:
+        if name not in self.defined and name not in self.external:
+            self.external[name] = (t, len(self.actions))
+
+def dump_terms(terms):
+    # one table of nodes for all the terms, shared subterms are written once
+    ids = {}
+    nodes = []
+    for t in terms:
+        todo = [t]
+        while len(todo) > 0:
+            u = todo[-1]
+            if u in ids:
+                todo.pop()
+                continue
+            children = [c for c in (u.left, u.right) if c != None and c not in ids]
+            if len(children) > 0:
+                todo += children
+                continue
+            todo.pop()
+            if u.type == term.TermType.ABSTRACT:
+                nodes.append(("a", u.var.name, ids[u.right]))
+            elif u.type == term.TermType.APPLY:
+                nodes.append(("p", ids[u.left], ids[u.right]))
+            elif u.type == term.TermType.NUMERAL:
+                nodes.append(("i", u.value))
+            elif u.index == None:
+                nodes.append(("n", u.name))
+            else:
+                nodes.append(("v", u.index))
+            ids[u] = len(nodes)-1
+    return nodes, [ids[t] for t in terms]
+
+def load_terms(nodes, roots):
+    built = []
+    for node in nodes:
+        if node[0] == "a":
+            built.append(term.Abstract(term.Variable(node[1]), built[node[2]], True))
+        elif node[0] == "p":
+            built.append(term.Apply(built[node[1]], built[node[2]]))
+        elif node[0] == "n":
+            built.append(term.Variable(node[1]))
+        elif node[0] == "i":
+            built.append(term.Numeral(node[1]))
+        else:
+            built.append(term.Variable(None, node[1]))
+    return [built[i] for i in roots]
+
+def file_hash(path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def module_cache_path(path, mode) -> str:
+    # lib.lc.nbe-True-False-True.json for (engine, beta, eta, native numerals)
+    name = os.path.basename(path)+"."+"-".join(str(m) for m in mode)+".json"
+    return os.path.join(os.path.dirname(path), CACHE_DIR, name)
+
+def save_module(record: ModuleRecord, mode, combinator: term.Term) -> None:
+    definitions = [a for a in record.actions if a[0] == "define"]
+    external = list(record.external.items())
+    terms = [t for kind, name, t, recursive in definitions]+[t for name, (t, k) in external]+[combinator]
+    nodes, roots = dump_terms(terms)
+    ids = iter(roots)
+    actions = [a if a[0] == "import" else ("define", a[1], next(ids), a[3]) for a in record.actions]
+    data = {
+        "version": CACHE_VERSION,
+        "mode": list(mode),
+        "hash": file_hash(record.path),
+        "nodes": nodes,
+        "actions": actions,
+        "external": [(name, next(ids), k) for name, (t, k) in external],
+        "combinator": roots[-1],
+    }
+    path = module_cache_path(record.path, mode)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(data, f)
+    except OSError:
+        # the cache is optional, read only directories are not an error
+        pass
+
+# modules already loaded by this process {(path, mode): (hash, cached)}, a
+# long running process reads and decodes each cache file only once
+loaded = {}
+
+def load_module(path, mode):
+    # returns (actions, external, combinator) or None if there is no up to
+    # date cache for this mode, external being [(name, term, number of
+    # actions replayed before it is checked)]
+    if (path, mode) in loaded:
+        h, cached = loaded[(path, mode)]
+        try:
+            if file_hash(path) == h:
+                return cached
+        except OSError:
+            pass
+        del loaded[(path, mode)]
+    try:
+        with open(module_cache_path(path, mode), "r") as f:
+            data = json.load(f)
+        if data["version"] != CACHE_VERSION or data["mode"] != list(mode) or file_hash(path) != data["hash"]:
+            return None
+        actions = data["actions"]
+        external = data["external"]
+        roots = [a[2] for a in actions if a[0] == "define"]+[i for name, i, k in external]+[data["combinator"]]
+        terms = iter(load_terms(data["nodes"], roots))
+        actions = [tuple(a) if a[0] == "import" else ("define", a[1], next(terms), a[3]) for a in actions]
+        external = [(name, next(terms), k) for name, i, k in external]
+        cached = (actions, external, next(terms))
+    except Exception:
+        # missing, unreadable or corrupted cache
+        return None
+    loaded[(path, mode)] = (data["hash"], cached)
+    return cached
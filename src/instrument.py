@@ -0,0 +1,96 @@
+import json
+import time
+import tracemalloc
+import term
+
+# Instrumentation of the rewriting engine (Term.beta_reduce, eta_reduce and
+# reduce): a Profile is given in stats["profile"] to normal_order, which
+# records every step (depth of the contracted redex, size and depth of the
+# term) and splits its time between the redex search, the contractions and
+# the printing of the steps. The substitutions and the node allocations are
+# read from the counters of term.Term, the peak memory from tracemalloc.
+
+def path_length(path) -> int:
+    n = 0
+    while path != None:
+        path = path[2]
+        n += 1
+    return n
+
+class Profile:
+    def __init__(self) -> None:
+        self.steps = 0
+        # variable occurrences replaced by an argument
+        self.substitutions = 0
+        # nodes built, and constructions which found an existing node
+        self.allocations = 0
+        self.shared = 0
+        # one entry per step
+        self.redex_depths = []
+        self.sizes = []
+        self.depths = []
+        self.search_time = 0.0
+        self.substitution_time = 0.0
+        self.printing_time = 0.0
+        self.total_time = 0.0
+        self.peak_memory = None
+        self.start_time = None
+        self.counters = None
+        self.tracing = False
+
+    def start(self) -> None:
+        self.counters = (term.Term.substituted, term.Term.misses, term.Term.hits)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        self.start_time = time.perf_counter()
+
+    def stop(self) -> None:
+        self.total_time += time.perf_counter()-self.start_time
+        substituted, misses, hits = self.counters
+        self.substitutions += term.Term.substituted-substituted
+        self.allocations += term.Term.misses-misses
+        self.shared += term.Term.hits-hits
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def step(self, t: term.Term, path) -> None:
+        # t is the term after a contraction at the end of path
+        self.steps += 1
+        self.redex_depths.append(path_length(path))
+        self.sizes.append(t.size)
+        self.depths.append(t.depth)
+
+    def report(self):
+        lines = [f"{self.steps} steps, {self.substitutions} substitutions, {self.allocations} nodes allocated, {self.shared} constructions shared."]
+        if self.steps > 0:
+            lines.append(f"Redex depth: {sum(self.redex_depths)/self.steps:.1f} on average, {max(self.redex_depths)} at most.")
+            lines.append(f"Term size: {self.sizes[0]} after the first step, {max(self.sizes)} at most, {self.sizes[-1]} at the end.")
+            lines.append(f"Term depth: {self.depths[0]} after the first step, {max(self.depths)} at most, {self.depths[-1]} at the end.")
+        other = self.total_time-self.search_time-self.substitution_time-self.printing_time
+        lines.append(f"Time: {self.total_time:.6f}s, redex search {self.search_time:.6f}s, substitution {self.substitution_time:.6f}s, printing {self.printing_time:.6f}s, other {other:.6f}s.")
+        if self.peak_memory != None:
+            lines.append(f"Peak memory: {self.peak_memory} bytes.")
+        return lines
+
+    def to_dict(self):
+        return {
+            "steps": self.steps,
+            "substitutions": self.substitutions,
+            "allocations": self.allocations,
+            "shared": self.shared,
+            "redex_depths": self.redex_depths,
+            "sizes": self.sizes,
+            "depths": self.depths,
+            "search_time": self.search_time,
+            "substitution_time": self.substitution_time,
+            "printing_time": self.printing_time,
+            "total_time": self.total_time,
+            "peak_memory": self.peak_memory,
+        }
+
+    def dump(self, path) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
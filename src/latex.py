@@ -0,0 +1,124 @@
+from collections import deque
+import os
+import term
+
+# Streaming export of the reduction steps as LaTeX forest trees. The
+# rewriting engine gives every step with the path of its redex, which is
+# highlighted without being searched again, so rendering a step is linear in
+# the size of the term. Steps can be sampled (every k-th step, the n first
+# ones, the n last ones, the normal form is always written) and split into
+# one .tex file per chunk of steps, the main file then inputs the chunks.
+# Only the last steps are held back (in order to know which ones are last),
+# the other ones are written as they come.
+
+class LatexExport:
+    def __init__(self, path, highlight = False, horizontal = False, every = None, first = None, last = None, split = None) -> None:
+        self.path = path
+        self.highlight = highlight
+        self.horizontal = horizontal
+        # every step by default
+        if every == None and first == None and last == None:
+            every = 1
+        self.every = every
+        self.first = first
+        self.last = last
+        self.split = split
+        self.queue = deque()
+        # number and kind of the last written step
+        self.previous = None
+        self.main = open(path, "w")
+        self.file = self.main if split == None else None
+        self.chunks = 0
+        self.in_chunk = 0
+
+    def sampled(self, n) -> bool:
+        if self.first != None and n < self.first:
+            return True
+        return self.every != None and n % self.every == 0
+
+    def step(self, n, t: term.Term, beta: bool, path) -> None:
+        # t is the whole term before step n+1, whose redex is at the end of
+        # path (a zipper path of (parent, side, up), innermost first)
+        if self.last == None:
+            if self.sampled(n):
+                self.write(n, t, beta, path)
+            return
+        self.queue.append((n, t, beta, path))
+        if len(self.queue) > self.last:
+            n, t, beta, path = self.queue.popleft()
+            if self.sampled(n):
+                self.write(n, t, beta, path)
+
+    def end(self, n, t: term.Term) -> None:
+        # normal form reached after n steps
+        self.flush()
+        self.write(n, t, None, None)
+
+    def flush(self) -> None:
+        # the held back steps are the last ones
+        while len(self.queue) > 0:
+            self.write(*self.queue.popleft())
+
+    def close(self) -> None:
+        self.flush()
+        if self.file != None and self.file is not self.main:
+            self.file.close()
+        self.main.close()
+
+    def output(self):
+        # file of the next step, a new chunk every split steps
+        if self.split != None and (self.file == None or self.in_chunk >= self.split):
+            if self.file != None:
+                self.file.close()
+            base, ext = os.path.splitext(self.path)
+            chunk = f"{base}_{self.chunks}{ext if ext != '' else '.tex'}"
+            self.main.write("\\input{"+chunk+"}\n")
+            self.main.flush()
+            self.file = open(chunk, "w")
+            self.chunks += 1
+            self.in_chunk = 0
+        self.in_chunk += 1
+        return self.file
+
+    def write(self, n, t: term.Term, beta, path) -> None:
+        # beta is None for the last term
+        f = self.output()
+        if self.previous != None:
+            self.write_sep(f, n)
+        if beta == None:
+            info_reduce = ""
+        else:
+            info_reduce = "(beta)" if beta else "(eta)"
+        redex = None
+        if self.highlight and beta != None:
+            redex = sides(path)
+        f.write(f"% step {n} {info_reduce}\n")
+        f.write("\\begin{forest}\n")
+        f.write("for tree={"+("grow=east," if self.horizontal else "")+"outer sep=0}\n")
+        f.write("["+t.latex_forest_format(beta != False, redex != None, None, redex)+"]\n")
+        f.write("\\node at (current bounding box.south) [below=1ex]{\\emph{step "+str(n)+"}};\n")
+        f.write("\\end{forest}"+("\\\\" if self.horizontal else ""))
+        f.write("\n")
+        self.previous = (n, beta)
+
+    def write_sep(self, f, n) -> None:
+        # one step of the kind of the previous redex, or several steps
+        previous, beta = self.previous
+        if previous == n-1:
+            symb = "_{\\beta}" if beta else "_{\\eta}"
+        else:
+            symb = "^{*}"
+        if self.horizontal:
+            f.write("$\\big\\downarrow"+symb+"$\\\\")
+        else:
+            f.write("$\\longrightarrow"+symb+"$")
+        f.write("\n")
+
+def sides(path):
+    # sides taken from the root down to the end of a zipper path
+    L = []
+    while path != None:
+        parent, side, path = path
+        L.append(side)
+    L.reverse()
+    return L
@@ -0,0 +1,143 @@
+import term
+from budget import Counter
+
+# Call-by-need graph reduction. Every argument becomes one shared heap node
+# (a thunk) which is overwritten with its weak head normal form the first
+# time it is needed, and with its normal form once it has been read back,
+# so a duplicated argument is reduced at most once.
+
+class Closure:
+    def __init__(self, abstract, env):
+        self.abstract = abstract
+        self.env = env
+
+class Neutral:
+    def __init__(self, head, args = ()):
+        # head is a de Bruijn level or a free (named) Variable
+        self.head = head
+        self.args = args
+
+class Thunk:
+    # live heap nodes of the current evaluation
+    counter = Counter()
+
+    def __init__(self, t, env, value = None):
+        self.term = t
+        self.env = env
+        self.value = value
+        # (normal form, level it was read back at)
+        self.normal = None
+        self.counter = Thunk.counter
+        self.counter.add()
+
+    def __del__(self):
+        self.counter.remove()
+
+class Update:
+    def __init__(self, thunk):
+        self.thunk = thunk
+
+class GraphReducer:
+    def __init__(self, budget = None) -> None:
+        self.steps = 0
+        self.budget = budget
+        self.counter = Thunk.counter = Counter()
+
+    def lookup(self, env, index):
+        for i in range(index):
+            env = env[1]
+        return env[0]
+
+    def whnf(self, thunk):
+        if thunk.value != None:
+            return thunk.value
+        stack = [Update(thunk)]
+        t, env = thunk.term, thunk.env
+        while True:
+            # unwind until a value is found
+            if t.type == term.TermType.APPLY:
+                arg = t.right
+                if arg.type == term.TermType.VARIABLE and arg.index != None:
+                    stack.append(self.lookup(env, arg.index))
+                else:
+                    stack.append(Thunk(arg, env))
+                t = t.left
+                continue
+            if t.type == term.TermType.ABSTRACT:
+                v = Closure(t, env)
+            elif t.index == None:
+                v = Neutral(t)
+            else:
+                th = self.lookup(env, t.index)
+                if th.value == None:
+                    stack.append(Update(th))
+                    t, env = th.term, th.env
+                    continue
+                v = th.value
+            # give the value to the continuation
+            while len(stack) > 0:
+                top = stack[-1]
+                if isinstance(top, Update):
+                    top.thunk.value = v
+                    top.thunk.term, top.thunk.env = None, None
+                    stack.pop()
+                elif isinstance(v, Neutral):
+                    v = Neutral(v.head, v.args+(stack.pop(),))
+                else:
+                    break
+            if len(stack) == 0:
+                return v
+            if self.budget != None:
+                self.budget.check(self.steps, self.counter.live+len(stack))
+            self.steps += 1
+            t, env = v.abstract.right, (stack.pop(), v.env)
+
+    def normalize(self, t: term.Term) -> term.Term:
+        env = None
+        for level in range(t.loose):
+            env = (Thunk(None, None, Neutral(level)), env)
+        todo = [("thunk", Thunk(t, env), t.loose)]
+        results = []
+        while len(todo) > 0:
+            task = todo.pop()
+            if task[0] == "thunk":
+                th, level = task[1], task[2]
+                if th.normal != None:
+                    # already read back, only the loose indices move
+                    nf, nf_level = th.normal
+                    results.append(nf.shift(level-nf_level) if level != nf_level else nf)
+                    continue
+                v = self.whnf(th)
+                todo.append(("store", th, level))
+                if isinstance(v, Closure):
+                    fresh = Thunk(None, None, Neutral(level))
+                    todo.append(("abstract", v.abstract.var))
+                    todo.append(("thunk", Thunk(v.abstract.right, (fresh, v.env)), level+1))
+                else:
+                    if isinstance(v.head, term.Variable):
+                        results.append(v.head)
+                    else:
+                        results.append(term.Variable(None, level-1-v.head))
+                    todo.append(("apply", len(v.args)))
+                    for arg in reversed(v.args):
+                        todo.append(("thunk", arg, level))
+            elif task[0] == "store":
+                task[1].normal = (results[-1], task[2])
+            elif task[0] == "abstract":
+                results.append(term.Abstract(task[1], results.pop(), True))
+            else:
+                n = task[1]
+                args = results[len(results)-n:]
+                del results[len(results)-n:]
+                t = results.pop()
+                for arg in args:
+                    t = term.Apply(t, arg)
+                results.append(t)
+        return results[0]
+
+def normalize(t: term.Term, budget = None):
+    # returns the normal form, the number of reductions and the peak number
+    # of live heap nodes
+    reducer = GraphReducer(budget)
+    t = reducer.normalize(t)
+    return (t, reducer.steps, reducer.counter.peak)
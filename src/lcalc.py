@@ -1,5 +1,6 @@
 import sys
 import os
+import batch
 from parser import FileReader, Parser, StringReader
 
 
@@ -7,12 +8,24 @@ if __name__ == "__main__":
 
     version = "Lcalc v1.0, JAFFUER Pierre"
 
-
-    sys.setrecursionlimit(10**9)
     clear = lambda : os.system('cls' if os.name=='nt' else 'clear')
     P = Parser()
 
-    if len(sys.argv) >= 2:
+    if len(sys.argv) >= 2 and sys.argv[1] == "--batch":
+        # evaluate many scripts (paths or glob patterns) in a pool of
+        # processes: lcalc.py --batch [-j workers] scripts...
+        usage = "Usage: python lcalc.py --batch [-j workers] scripts..."
+        args = sys.argv[2:]
+        workers = None
+        if len(args) > 0 and args[0] == "-j":
+            if len(args) < 2 or not args[1].isdigit() or int(args[1]) < 1:
+                sys.exit(usage)
+            workers = int(args[1])
+            args = args[2:]
+        if len(args) == 0:
+            sys.exit(usage)
+        sys.exit(1 if batch.run(args, workers) > 0 else 0)
+    elif len(sys.argv) >= 2:
         #load file
         path = sys.argv[1]
         with open(path, "r") as f:
@@ -0,0 +1,158 @@
+import term
+from budget import Counter
+
+# Strong Krivine machine: call-by-name reduction to weak head normal form,
+# then under the binders and into the arguments of neutral terms, which is
+# the leftmost outermost order. Arguments are closures shared through the
+# environments instead of being copied into the term, so the number of
+# contractions is the same as with Term.beta_reduce but nothing is rebuilt
+# until the normal form is read back.
+
+class Closure:
+    # live closures of the current evaluation
+    counter = Counter()
+
+    def __init__(self, t, env):
+        self.term = t
+        self.env = env
+        self.counter = Closure.counter
+        self.counter.add()
+
+    def __del__(self):
+        self.counter.remove()
+
+class Machine:
+    def __init__(self, max_steps=-1, budget=None) -> None:
+        self.steps = 0
+        self.max_steps = max_steps
+        self.budget = budget
+        # cache of read back closures, used when the machine is stopped
+        self.quoted = {}
+        self.counter = Closure.counter = Counter()
+
+    def lookup(self, env, index):
+        for i in range(index):
+            env = env[1]
+        return env[0]
+
+    def stopped(self, pending = 0):
+        # nodes: the live closures and the pending arguments, which share
+        # closures
+        if self.budget != None and self.budget.exceeded(self.steps, self.counter.live+pending):
+            return True
+        return self.max_steps >= 0 and self.steps >= self.max_steps+1
+
+    def normalize(self, t: term.Term) -> term.Term:
+        # loose indices of an open term are levels of the initial environment
+        env = None
+        for level in range(t.loose):
+            env = (level, env)
+        return self.resume([("eval", Closure(t, env), t.loose)], [])
+
+    def resume(self, todo, results) -> term.Term:
+        # tasks: ("eval", closure or level, level), ("term", normal form
+        # already computed, see value), ("abstract", var) and ("apply",
+        # number of arguments), the normal form is built in results
+        while len(todo) > 0:
+            task = todo.pop()
+            if task[0] == "eval":
+                if isinstance(task[1], int):
+                    results.append(term.Variable(None, task[2]-1-task[1]))
+                elif self.stopped():
+                    results.append(self.quote(task[1], task[2]))
+                else:
+                    self.run(task[1], task[2], todo, results)
+            elif task[0] == "term":
+                results.append(self.value(task[1]))
+            elif task[0] == "abstract":
+                results.append(term.Abstract(task[1], results.pop(), True))
+            else:
+                n = task[1]
+                args = results[len(results)-n:]
+                del results[len(results)-n:]
+                t = results.pop()
+                for arg in args:
+                    t = term.Apply(t, arg)
+                results.append(t)
+        return results[0]
+
+    def value(self, r) -> term.Term:
+        # normal form of a "term" task
+        return r
+
+    def run(self, closure, level, todo, results):
+        t, env = closure.term, closure.env
+        stack = []
+        while True:
+            if t.type == term.TermType.APPLY:
+                arg = t.right
+                if arg.type == term.TermType.VARIABLE and arg.index != None:
+                    stack.append(self.lookup(env, arg.index))
+                else:
+                    stack.append(Closure(arg, env))
+                t = t.left
+            elif t.type == term.TermType.ABSTRACT:
+                if len(stack) == 0:
+                    # weak head normal form, continue under the binder
+                    todo.append(("abstract", t.var))
+                    env = (level, env)
+                    level += 1
+                    t = t.right
+                elif self.stopped(len(stack)):
+                    break
+                else:
+                    self.steps += 1
+                    env = (stack.pop(), env)
+                    t = t.right
+            elif t.index != None:
+                c = self.lookup(env, t.index)
+                if isinstance(c, int):
+                    break
+                t, env = c.term, c.env
+            else:
+                break
+        # neutral term or stopped machine, the arguments are reduced next
+        if t.type != term.TermType.VARIABLE:
+            results.append(self.quote(Closure(t, env), level))
+        elif t.index == None:
+            results.append(t)
+        else:
+            results.append(term.Variable(None, level-1-self.lookup(env, t.index)))
+        todo.append(("apply", len(stack)))
+        for c in stack:
+            todo.append(("eval", c, level))
+
+    def quote(self, closure, level):
+        # substitute the environment of a closure into its term, the
+        # closures it refers to are quoted first
+        todo = [(closure, level)]
+        while len(todo) > 0:
+            key = todo[-1]
+            if key in self.quoted:
+                todo.pop()
+                continue
+            c, level = key
+            missing = []
+            def leaf(t, depth):
+                if t.loose <= depth:
+                    return t
+                if t.type == term.TermType.VARIABLE:
+                    e = self.lookup(c.env, t.index-depth)
+                    if isinstance(e, int):
+                        return term.Variable(None, level+depth-1-e)
+                    if (e, level+depth) in self.quoted:
+                        return self.quoted[(e, level+depth)]
+                    missing.append((e, level+depth))
+                    return t
+            t = c.term.rebuild(leaf)
+            if len(missing) > 0:
+                todo += missing
+            else:
+                self.quoted[key] = t
+                todo.pop()
+        return self.quoted[(closure, level)]
+
+def normalize(t: term.Term, max_steps=-1, budget=None):
+    machine = Machine(max_steps, budget)
+    t = machine.normalize(t)
+    return (t, machine.steps)
@@ -0,0 +1,339 @@
+import term
+from budget import Counter
+
+# Normalization by evaluation: terms are evaluated into a semantic domain of
+# closures and neutral values, then the normal form is read back. Arguments
+# are passed as thunks forced at most once (call-by-need), so only the
+# arguments that normal order reduction would reduce are evaluated.
+
+class Closure:
+    def __init__(self, abstract, env):
+        self.abstract = abstract
+        self.env = env
+
+class Neutral:
+    def __init__(self, head, args = ()):
+        # head is a de Bruijn level or a free (named) Variable
+        self.head = head
+        self.args = args
+
+class Number:
+    # native numeral
+    def __init__(self, value):
+        self.value = value
+
+class Thunk:
+    # live thunks of the current evaluation
+    counter = Counter()
+
+    def __init__(self, t, env, value = None):
+        self.term = t
+        self.env = env
+        self.value = value
+        self.counter = Thunk.counter
+        self.counter.add()
+
+    def __del__(self):
+        self.counter.remove()
+
+# operations computed directly: number of arguments, and the operation which
+# gets its arguments evaluated one by one (only when they are needed) with
+# arg(i) and returns the result, or None when they are not numbers or tuples
+def numeral_value(t):
+    # value of a Church numeral λf x.f (... (f x)), or None
+    if t.type != term.TermType.ABSTRACT or t.right.type != term.TermType.ABSTRACT:
+        return None
+    t = t.right.right
+    n = 0
+    while t.type == term.TermType.APPLY:
+        if t.left.type != term.TermType.VARIABLE or t.left.index != 1:
+            return None
+        n += 1
+        t = t.right
+    return n if t.type == term.TermType.VARIABLE and t.index == 0 else None
+
+def number(v):
+    # native numerals, and Church numerals of the terms parsed before
+    # numerals native;
+    if isinstance(v, Number):
+        return v.value
+    if isinstance(v, Closure):
+        return numeral_value(v.abstract)
+    return None
+
+def numeral(n):
+    # 0 is left as the Church numeral λf x.x, like the reduction of the
+    # Church definitions gives it
+    return Number(n) if n > 0 else Closure(ZERO, None)
+
+def boolean(b):
+    return Closure(TRUE if b else FALSE, None)
+
+def unary(f):
+    def op(arg):
+        n = number(arg(0))
+        return None if n == None else f(n)
+    return op
+
+def binary(f):
+    def op(arg):
+        n = number(arg(0))
+        m = number(arg(1)) if n != None else None
+        return None if m == None else f(n, m)
+    return op
+
+def multiply(arg):
+    n = number(arg(0))
+    if n == 0:
+        return numeral(0)
+    m = number(arg(1)) if n != None else None
+    return None if m == None else numeral(n*m)
+
+def power(arg):
+    # exp n 0 is 0 n, the identity
+    m = number(arg(1))
+    if m == 0:
+        return Closure(IDENTITY, None)
+    n = number(arg(0)) if m != None else None
+    return None if n == None else numeral(n**m)
+
+def projection(arg):
+    # proj n i c, the element is evaluated in the environment of the tuple
+    c = arg(2)
+    if not isinstance(c, Closure) or c.abstract.items == None:
+        return None
+    n, i = number(arg(0)), number(arg(1))
+    if n != len(c.abstract.items) or i == None or i < 1 or i > n:
+        return None
+    item = c.abstract.items[i-1]
+    if item.has_index(0):
+        return None
+    return Thunk(item, (None, c.env))
+
+PRIMITIVES = {
+    "succ": (1, unary(lambda n: numeral(n+1))),
+    "pred": (1, unary(lambda n: numeral(n-1 if n > 0 else 0))),
+    "iszero": (1, unary(lambda n: boolean(n == 0))),
+    "add": (2, binary(lambda n, m: numeral(n+m))),
+    "sub": (2, binary(lambda n, m: numeral(n-m if n > m else 0))),
+    "mult": (2, multiply),
+    "exp": (2, power),
+    "proj": (3, projection),
+}
+
+def var(index):
+    return term.Variable(None, index)
+
+def lam(names, body):
+    for name in reversed(names):
+        body = term.Abstract(term.Variable(name), body, True)
+    return body
+
+def app(*terms):
+    t = terms[0]
+    for arg in terms[1:]:
+        t = term.Apply(t, arg)
+    return t
+
+TRUE = lam("xy", var(1))
+FALSE = lam("xy", var(0))
+IDENTITY = lam("x", var(0))
+ZERO = lam("fx", var(0))
+
+# The operations are recognized by alpha equivalence with the definitions
+# of numbers.lc and tuples.lc, whatever their name, in normal form as :=
+# leaves them: {hash: [(term, operation)]}
+def references():
+    succ = lam("nfx", app(var(1), app(var(2), var(1), var(0))))
+    pred = lam("nfx", app(var(2), lam("gh", app(var(0), app(var(1), var(3)))), lam("u", var(1)), lam("z", var(0))))
+    sub = lam("nm", app(var(0), pred, var(1)))
+    terms = [
+        ("succ", succ),
+        ("pred", pred),
+        ("iszero", lam("nxy", app(var(2), lam("z", var(1)), var(1)))),
+        ("add", lam("nmfx", app(var(3), var(1), app(var(2), var(1), var(0))))),
+        ("sub", sub),
+        ("mult", lam("nmf", app(var(2), app(var(1), var(0))))),
+        ("exp", lam("nm", app(var(0), var(1)))),
+        ("proj", lam("nic", app(var(0), app(pred, var(1), lam("py", var(1)), app(sub, var(2), var(1), lam("px", app(var(1), lam("y", var(1)))), lam("x", var(0))))))),
+    ]
+    index = {}
+    for name, t in terms:
+        t = t.beta_reduce()[0]
+        index.setdefault(t.hash, []).append((t, name))
+    return index
+
+REFERENCES = references()
+
+class Evaluator:
+    def __init__(self, native = False, budget = None) -> None:
+        # number of beta contractions (closures applied to an argument)
+        self.steps = 0
+        self.budget = budget
+        # the operations of REFERENCES are computed directly with native
+        # numerals, {abstract: operation or None}
+        self.native = native
+        self.known = {}
+        self.counter = Thunk.counter = Counter()
+
+    def lookup(self, env, index):
+        for i in range(index):
+            env = env[1]
+        return env[0]
+
+    def force(self, thunk):
+        if thunk.value == None:
+            thunk.value = self.evaluate(thunk.term, thunk.env)
+            thunk.term, thunk.env = None, None
+        return thunk.value
+
+    def primitive(self, abstract):
+        if abstract not in self.known:
+            self.known[abstract] = None
+            for t, name in REFERENCES.get(abstract.hash, ()):
+                if abstract.is_equals(t):
+                    self.known[abstract] = name
+                    break
+        return self.known[abstract]
+
+    def compute(self, v, spine):
+        # a recognized operation applied to numbers or tuples is computed at
+        # once. Returns ("value", v), ("wait", thunk) when an argument has to
+        # be evaluated first, ("eval", thunk) when the result is the value of
+        # thunk, or None
+        name = self.primitive(v.abstract) if self.native else None
+        if name == None or len(spine) < PRIMITIVES[name][0]:
+            return None
+        waiting = []
+        def arg(i):
+            thunk = spine[-1-i]
+            if thunk.value == None:
+                waiting.append(thunk)
+            return thunk.value
+        r = PRIMITIVES[name][1](arg)
+        if len(waiting) > 0:
+            return ("wait", waiting[0])
+        if r == None:
+            return None
+        del spine[len(spine)-PRIMITIVES[name][0]:]
+        self.steps += 1
+        if isinstance(r, Thunk):
+            return ("value", r.value) if r.value != None else ("eval", r)
+        return ("value", r)
+
+    def evaluate(self, t, env):
+        # Evaluations waiting for a thunk are suspended on a stack instead of
+        # recursing: (thunk, spine, closure to retry once the thunk is
+        # evaluated or None to go on with its value)
+        stack = []
+        spine = []
+        while True:
+            # unwind the application spine
+            while t.type == term.TermType.APPLY:
+                arg = t.right
+                if arg.type == term.TermType.VARIABLE and arg.index != None:
+                    # share the already existing thunk
+                    spine.append(self.lookup(env, arg.index))
+                else:
+                    spine.append(Thunk(arg, env))
+                t = t.left
+            if t.type == term.TermType.ABSTRACT:
+                v = Closure(t, env)
+            elif t.type == term.TermType.NUMERAL:
+                v = Number(t.value)
+            elif t.index == None:
+                v = Neutral(t)
+            else:
+                thunk = self.lookup(env, t.index)
+                if thunk.value == None:
+                    stack.append((thunk, spine, None))
+                    t, env, spine = thunk.term, thunk.env, []
+                    continue
+                v = thunk.value
+            while True:
+                # apply the arguments
+                suspended = False
+                while len(spine) > 0:
+                    if isinstance(v, Neutral):
+                        v = Neutral(v.head, v.args+(spine.pop(),))
+                    elif isinstance(v, Number):
+                        # applied as a function, back to the Church encoding
+                        v = Closure(term.church(v.value), None)
+                    else:
+                        r = self.compute(v, spine)
+                        if r == None:
+                            break
+                        if r[0] == "value":
+                            v = r[1]
+                            continue
+                        stack.append((r[1], spine, v if r[0] == "wait" else None))
+                        t, env, spine = r[1].term, r[1].env, []
+                        suspended = True
+                        break
+                if suspended:
+                    break
+                if len(spine) > 0:
+                    if self.budget != None:
+                        self.budget.check(self.steps, self.counter.live+len(spine))
+                    self.steps += 1
+                    t, env = v.abstract.right, (spine.pop(), v.env)
+                    break
+                # v is a value, resume the suspended evaluation
+                if len(stack) == 0:
+                    return v
+                thunk, spine, retry = stack.pop()
+                thunk.value = v
+                thunk.term, thunk.env = None, None
+                if retry != None:
+                    v = retry
+
+    def read_back(self, v, level):
+        todo = [("value", v, level)]
+        results = []
+        while len(todo) > 0:
+            task = todo.pop()
+            if task[0] == "value":
+                v, level = task[1], task[2]
+                if isinstance(v, Number):
+                    results.append(term.Numeral(v.value))
+                elif isinstance(v, Closure):
+                    # apply to a fresh variable and read back the body
+                    fresh = Thunk(None, None, Neutral(level))
+                    body = self.evaluate(v.abstract.right, (fresh, v.env))
+                    todo.append(("abstract", v.abstract.var))
+                    todo.append(("value", body, level+1))
+                else:
+                    if isinstance(v.head, term.Variable):
+                        results.append(v.head)
+                    else:
+                        results.append(term.Variable(None, level-1-v.head))
+                    todo.append(("apply", len(v.args)))
+                    for arg in reversed(v.args):
+                        todo.append(("thunk", arg, level))
+            elif task[0] == "thunk":
+                todo.append(("value", self.force(task[1]), task[2]))
+            elif task[0] == "abstract":
+                results.append(term.Abstract(task[1], results.pop(), True))
+            else:
+                n = task[1]
+                args = results[len(results)-n:]
+                del results[len(results)-n:]
+                t = results.pop()
+                for arg in args:
+                    t = term.Apply(t, arg)
+                results.append(t)
+        return results[0]
+
+    def normalize(self, t: term.Term) -> term.Term:
+        # loose indices of an open term are read back as themselves
+        env = None
+        for level in range(t.loose):
+            env = (Thunk(None, None, Neutral(level)), env)
+        return self.read_back(self.evaluate(t, env), t.loose)
+
+def normalize(t: term.Term, native = False, budget = None):
+    # native: the operations of PRIMITIVES are computed directly on numbers
+    # and tuples
+    evaluator = Evaluator(native, budget)
+    t = evaluator.normalize(t)
+    return (t, evaluator.steps)
@@ -0,0 +1,329 @@
+import term
+
+# Experimental optimal reduction (Lamping's algorithm with the bracket and
+# croissant oracle). A term is translated into a sharing graph, redexes are
+# contracted as local interactions so that a subterm is duplicated only
+# when an interaction needs it (even under binders), and an ordinary term
+# is read back from the graph.
+#
+# Every node has a principal port 0, interactions happen between two nodes
+# connected by their principal ports. Levels count the nesting of the
+# arguments: the argument of an application at level n is at level n+1.
+
+ROOT = 0
+LAM = 1 # 1: body, 2: bound variable
+APP = 2 # 0: function, 1: argument, 2: result
+FAN = 3 # 1, 2: shared sides
+CRO = 4 # croissant, 1: variable side
+BRA = 5 # bracket, 1: inner side
+ERA = 6
+FREE = 7 # free (named) variable
+
+ARITY = {ROOT: 2, LAM: 3, APP: 3, FAN: 3, CRO: 2, BRA: 2, ERA: 1, FREE: 1}
+CONTROL = (FAN, CRO, BRA)
+
+class Node:
+    # nodes built: every interaction removes its two nodes, a net has the
+    # nodes created since it started less 2*interactions
+    created = 0
+
+    def __init__(self, kind, level = 0, data = None):
+        Node.created += 1
+        self.kind = kind
+        self.level = level
+        # binder Variable of a LAM (for its name) or the free Variable
+        self.data = data
+        self.ports = [None]*ARITY[kind]
+
+def connect(a, i, b, j):
+    a.ports[i] = (b, j)
+    b.ports[j] = (a, i)
+
+class Net:
+    def __init__(self, budget = None) -> None:
+        self.budget = budget
+        # beta interactions and interactions of any kind
+        self.steps = 0
+        self.interactions = 0
+        # nodes created before this net
+        self.created = Node.created
+        # binder reached from a control node of a variable wire
+        self.binders = {}
+
+    # TRANSLATION
+    def translate(self, t: term.Term):
+        # Built bottom-up, every subterm gives its root port and the end of
+        # the wire of each of its free variables. At an application, the
+        # variables of the argument leave its level through a bracket and
+        # the ones occurring on both sides are shared by a fan.
+        self.root = Node(ROOT)
+        # open terms: loose indices are bound by invisible binders
+        self.outer = [Node(LAM, 0, term.Variable(f"v{i}")) for i in range(t.loose)]
+        binders = list(self.outer)
+        todo = [(t, 0, False)]
+        results = []
+        while len(todo) > 0:
+            t, level, done = todo.pop()
+            if t.type == term.TermType.ABSTRACT:
+                if not done:
+                    binders.append(Node(LAM, level, t.var))
+                    todo.append((t, level, True))
+                    todo.append((t.right, level, False))
+                    continue
+                lam = binders.pop()
+                body, ends = results.pop()
+                connect(lam, 1, *body)
+                if lam in ends:
+                    connect(lam, 2, *ends.pop(lam))
+                else:
+                    connect(lam, 2, Node(ERA), 0)
+                results.append(((lam, 0), ends))
+            elif t.type == term.TermType.APPLY:
+                if not done:
+                    todo.append((t, level, True))
+                    todo.append((t.right, level+1, False))
+                    todo.append((t.left, level, False))
+                    continue
+                arg, arg_ends = results.pop()
+                function, ends = results.pop()
+                app = Node(APP, level)
+                connect(app, 0, *function)
+                connect(app, 1, *arg)
+                for lam, end in arg_ends.items():
+                    bra = Node(BRA, level)
+                    connect(bra, 1, *end)
+                    if lam in ends:
+                        fan = Node(FAN, level)
+                        connect(fan, 1, *ends[lam])
+                        connect(fan, 2, bra, 0)
+                        ends[lam] = (fan, 0)
+                    else:
+                        ends[lam] = (bra, 0)
+                results.append(((app, 2), ends))
+            elif t.index == None:
+                free = Node(FREE, 0, t)
+                results.append(((free, 0), {}))
+            else:
+                # croissant at the occurrence
+                cro = Node(CRO, level)
+                results.append(((cro, 1), {binders[-1-t.index]: (cro, 0)}))
+        root, ends = results.pop()
+        connect(self.root, 1, *root)
+        for lam in self.outer:
+            if lam in ends:
+                connect(lam, 2, *ends[lam])
+            else:
+                connect(lam, 2, Node(ERA), 0)
+
+    # INTERACTIONS
+    def rewire(self, a, b, pairs):
+        # connect the outside ends of the given pairs of ports of a and b
+        dying = {}
+        for p, q in pairs:
+            dying[p], dying[q] = q, p
+        def outside(p):
+            while True:
+                node, i = p[0].ports[p[1]]
+                if (node is a or node is b) and (node is a, i) in dying:
+                    p = (a if dying[(node is a, i)][0] else b, dying[(node is a, i)][1])
+                else:
+                    return (node, i)
+        ends = [(outside((a if p[0] else b, p[1])), outside((a if q[0] else b, q[1]))) for p, q in pairs]
+        for (n1, i1), (n2, i2) in ends:
+            connect(n1, i1, n2, i2)
+
+    def replace(self, a, b, new_ports):
+        # new_ports maps the auxiliary ports of a and b to ports of new nodes
+        for (is_a, i), (node, j) in new_ports.items():
+            old = a if is_a else b
+            other, k = old.ports[i]
+            if (other is a or other is b) and (other is a, k) in new_ports:
+                node2, j2 = new_ports[(other is a, k)]
+                connect(node, j, node2, j2)
+            else:
+                connect(node, j, other, k)
+
+    def interact(self, a, b):
+        if self.budget != None:
+            self.budget.check(self.steps, Node.created-self.created-2*self.interactions)
+        self.interactions += 1
+        if a.kind == APP and b.kind == LAM:
+            a, b = b, a
+        if a.kind == LAM and b.kind == APP:
+            # result to body, argument to bound variable
+            self.steps += 1
+            self.rewire(a, b, [((True, 1), (False, 2)), ((True, 2), (False, 1))])
+        elif a.kind == ERA or b.kind == ERA:
+            if a.kind != ERA:
+                a, b = b, a
+            new_ports = {}
+            for i in range(1, len(b.ports)):
+                new_ports[(False, i)] = (Node(ERA), 0)
+            self.replace(a, b, new_ports)
+        elif a.kind in CONTROL and b.kind == a.kind and a.level == b.level:
+            # annihilation
+            self.rewire(a, b, [((True, i), (False, i)) for i in range(1, len(a.ports))])
+        else:
+            if a.kind not in CONTROL or (b.kind in CONTROL and b.level < a.level):
+                a, b = b, a
+            if a.kind not in CONTROL or (b.kind != FREE and b.level <= a.level):
+                raise ValueError("Unexpected interaction in the sharing graph.")
+            self.commute(a, b)
+
+    def commute(self, c, x):
+        # the control node c goes through x, x is copied once per auxiliary
+        # port of c and its level is moved by brackets and croissants
+        level = x.level
+        if c.kind == CRO:
+            level -= 1
+        elif c.kind == BRA:
+            level += 1
+        xs = [Node(x.kind, level, x.data) for i in range(1, len(c.ports))]
+        cs = [Node(c.kind, c.level) for i in range(1, len(x.ports))]
+        for i, xi in enumerate(xs):
+            for j, cj in enumerate(cs):
+                connect(xi, j+1, cj, i+1)
+        new_ports = {}
+        for i, xi in enumerate(xs):
+            new_ports[(True, i+1)] = (xi, 0)
+        for j, cj in enumerate(cs):
+            new_ports[(False, j+1)] = (cj, 0)
+        self.replace(c, x, new_ports)
+
+    # READ BACK
+    # A context has one entry per level: None, a fan choice pushed on an
+    # entry ("f", side, rest) or two levels paired by a bracket ("p", a, b).
+    # Only the entries which are not None are kept, as a sorted tuple of
+    # (level, entry): a bracket or a croissant moves the levels above it.
+
+    def get(self, context, i):
+        for level, entry in context:
+            if level == i:
+                return entry
+        return None
+
+    def update(self, context, i, entries, d):
+        # drop the levels from i to i+len(entries)-1, move the levels above
+        # by d and put entries from level i
+        n = len(entries)
+        result = [(level if level < i else level+d, entry) for level, entry in context if level < i or level >= i+n]
+        result += [(i+k, entry) for k, entry in enumerate(entries) if entry != None]
+        result.sort(key=lambda e: e[0])
+        return tuple(result)
+
+    def enter_aux(self, node, port, context):
+        i = node.level
+        if node.kind == FAN:
+            return self.update(context, i, [("f", port, self.get(context, i))], 0)
+        elif node.kind == CRO:
+            # new empty level i
+            return self.update(context, i, [], 1)
+        else:
+            a, b = self.get(context, i), self.get(context, i+1)
+            return self.update(context, i, [("p", a, b) if a != None or b != None else None, None], -1)
+
+    def enter_principal(self, node, context):
+        # returns the auxiliary port to leave from and the new context
+        i = node.level
+        entry = self.get(context, i)
+        if node.kind == FAN:
+            if entry == None or entry[0] != "f":
+                raise ValueError("Unmatched sharing in the sharing graph.")
+            return entry[1], self.update(context, i, [entry[2]], 0)
+        elif node.kind == CRO:
+            return 1, self.update(context, i, [None], -1)
+        else:
+            a, b = (entry[1], entry[2]) if entry != None else (None, None)
+            return 1, self.update(self.update(context, i, [a], 1), i+1, [b], 0)
+
+    def head(self, node, port, context):
+        # follow the function side from an auxiliary port, contracting the
+        # active pairs met on the way, until a value or variable is found.
+        # The walk resumes from the node preceding a contracted pair.
+        path = [(node, port, context, 0)]
+        spine = []
+        while True:
+            node, port, ctx, n = path[-1]
+            del spine[n:]
+            other, i = node.ports[port]
+            if other.kind == FREE:
+                return (other, 0, ctx, spine)
+            if port == 0 and i == 0:
+                self.interact(node, other)
+                path.pop()
+                continue
+            if i == 0:
+                if other.kind in CONTROL:
+                    i, ctx = self.enter_principal(other, ctx)
+                    path.append((other, i, ctx, len(spine)))
+                    continue
+                return (other, 0, ctx, spine)
+            if other in self.binders:
+                # entered by an auxiliary port, see below
+                other, i = self.binders[other], 2
+            if other.kind == LAM and i == 2:
+                # the wire above the control nodes entered by an auxiliary
+                # port is fixed once its binder is read back
+                for entry in reversed(path):
+                    if entry[1] != 0 or entry[0].kind not in CONTROL:
+                        break
+                    self.binders[entry[0]] = other
+                return (other, i, ctx, spine)
+            if other.kind == LAM or other.kind == ROOT:
+                return (other, i, ctx, spine)
+            if other.kind == APP:
+                if i != 2:
+                    raise ValueError("Unexpected application in the sharing graph.")
+                spine.append((other, ctx))
+            else:
+                ctx = self.enter_aux(other, i, ctx)
+            path.append((other, 0, ctx, len(spine)))
+
+    def read_back(self):
+        todo = [("read", self.root, 1, (), list(self.outer))]
+        results = []
+        while len(todo) > 0:
+            task = todo.pop()
+            if task[0] == "read":
+                node, port, context, binders = task[1], task[2], task[3], task[4]
+                h, i, ctx, spine = self.head(node, port, context)
+                todo.append(("apply", len(spine)))
+                for app, app_ctx in spine:
+                    todo.append(("read", app, 1, app_ctx, binders))
+                if h.kind == LAM and i == 0:
+                    if len(spine) > 0:
+                        raise ValueError("Unexpected redex in the sharing graph.")
+                    todo.append(("abstract", h.data))
+                    todo.append(("read", h, 1, ctx, binders+[h]))
+                elif h.kind == LAM and i == 2:
+                    # innermost binder instance of this node
+                    k = len(binders)-1
+                    while binders[k] is not h:
+                        k -= 1
+                    results.append(term.Variable(None, len(binders)-1-k))
+                elif h.kind == FREE:
+                    results.append(h.data)
+                else:
+                    raise ValueError("Unexpected node in the sharing graph.")
+            elif task[0] == "abstract":
+                results.append(term.Abstract(task[1], results.pop(), True))
+            else:
+                n = task[1]
+                args = results[len(results)-n:]
+                del results[len(results)-n:]
+                t = results.pop()
+                for arg in args:
+                    t = term.Apply(t, arg)
+                results.append(t)
+        return results[0]
+
+    def normalize(self, t: term.Term) -> term.Term:
+        self.translate(t)
+        return self.read_back()
+
+def normalize(t: term.Term, budget = None):
+    # returns the normal form, the number of beta interactions and the total
+    # number of interactions
+    net = Net(budget)
+    t = net.normalize(t)
+    return (t, net.steps, net.interactions)
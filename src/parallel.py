@@ -0,0 +1,140 @@
+import concurrent.futures
+import copy
+import os
+import cache
+import machine
+import term
+
+# Parallel normalization: the strong Krivine machine reduces the term to
+# head normal form, then the arguments of the head are independent. Each
+# argument is first reduced here for a few steps: most are then normal, and
+# when at least two are not, all of them but one are normalized by other
+# processes while the machine goes on with the remaining one. Normal forms
+# are unique, so the result and the total number of reductions are the ones
+# of the sequential leftmost outermost reduction. Terms are hash-consed,
+# they are sent to the workers as node tables.
+
+# reductions tried on an argument before it is sent to a worker. A round
+# trip to the pool costs 20 to 30ms for the first task (the workers are
+# started) and 1ms after, the machine makes about 150000 reductions a
+# second: an argument still not normal after 20000 reductions (0.13s) has
+# enough work left to pay for its process
+PROBE_STEPS = 20000
+
+# processes the work can be spread on
+WORKERS = os.cpu_count() or 1
+
+pool = None
+
+def get_pool():
+    global pool
+    if pool == None:
+        pool = concurrent.futures.ProcessPoolExecutor(os.cpu_count())
+    return pool
+
+def shutdown():
+    # the workers are not daemons, a process must stop them before exiting
+    global pool
+    if pool != None:
+        pool.shutdown()
+        pool = None
+
+def normalize_task(nodes, roots, budget):
+    # run by a worker, returns the normal form as a node table
+    t = cache.load_terms(nodes, roots)[0]
+    t, n = machine.normalize(t, -1, budget)
+    nodes, roots = cache.dump_terms([t])
+    return (nodes, roots, n, budget.reason if budget != None else None)
+
+class ParallelMachine(machine.Machine):
+    def __init__(self, probe = PROBE_STEPS, budget = None) -> None:
+        super().__init__(-1, budget)
+        self.probe = probe
+        self.tasks = 0
+
+    def normalize(self, t: term.Term):
+        # Same as Machine.normalize once the arguments of the head normal
+        # form are probed: an argument is then either a "term" task, its
+        # normal form or the future of a worker, or an "eval" task of its
+        # partially reduced term
+        env = None
+        for level in range(t.loose):
+            env = (level, env)
+        todo = [("eval", machine.Closure(t, env), t.loose)]
+        results = []
+        if WORKERS < 2 or self.stopped():
+            return self.resume(todo, results)
+        task = todo.pop()
+        self.run(task[1], task[2], todo, results)
+        # the arguments are the eval tasks after ("apply", n), the first
+        # one on top
+        k = len(todo)
+        while k > 0 and todo[k-1][0] == "eval":
+            k -= 1
+        if len(todo)-k < 2:
+            return self.resume(todo, results)
+        args = todo[k:]
+        del todo[k:]
+        probed = [self.probe_task(task) for task in args]
+        heavy = [i for i, task in enumerate(probed) if task[0] == "eval"]
+        if len(heavy) >= 2 and not self.stopped():
+            # the first one popped is reduced here while the workers run
+            for i in heavy[:-1]:
+                closure, level = probed[i][1], probed[i][2]
+                nodes, roots = cache.dump_terms([self.quote(closure, level)])
+                probed[i] = ("term", get_pool().submit(normalize_task, nodes, roots, self.worker_budget()))
+                self.tasks += 1
+        return self.resume(todo+probed, results)
+
+    def probe_task(self, task):
+        # reduces the argument of an "eval" task for self.probe steps,
+        # returns a "term" task if it is then normal, else an "eval" task of
+        # the partially reduced term
+        if isinstance(task[1], int) or self.stopped():
+            return task
+        level = task[2]
+        probe = machine.Machine(self.probe, self.worker_budget())
+        u = probe.normalize(self.quote(task[1], level))
+        # the closures made from now on are counted in this evaluation
+        machine.Closure.counter = self.counter
+        self.steps += probe.steps
+        if probe.budget != None:
+            self.exhausted(probe.budget.reason)
+        if not u.has_beta:
+            return ("term", u)
+        env = None
+        for l in range(level):
+            env = (l, env)
+        return ("eval", machine.Closure(u, env), level)
+
+    def worker_budget(self):
+        # the reductions already made here are taken from the step limit
+        if self.budget == None:
+            return None
+        b = copy.copy(self.budget)
+        if b.steps != None:
+            b.steps = max(b.steps-self.steps, 0)
+        return b
+
+    def exhausted(self, reason) -> None:
+        # a limit exceeded by a probe or a worker, named as the budget of the
+        # whole evaluation names it (the step limits of the workers are what
+        # was left of it)
+        if reason != None and not self.budget.exceeded(self.steps):
+            self.budget.reason = reason
+
+    def value(self, r) -> term.Term:
+        # waits for the worker of a future
+        if not isinstance(r, concurrent.futures.Future):
+            return r
+        nodes, roots, n, reason = r.result()
+        self.steps += n
+        self.exhausted(reason)
+        return cache.load_terms(nodes, roots)[0]
+
+def normalize(t: term.Term, probe = PROBE_STEPS, budget = None):
+    # returns the normal form, the number of reductions and the number of
+    # arguments normalized by the workers
+    m = ParallelMachine(probe, budget)
+    t = m.normalize(t)
+    return (t, m.steps, m.tasks)
@@ -1,6 +1,17 @@
 import sys
 import term
+import nbe
+import machine
+import lazy
+import optimal
+import parallel
+import cache
+import budget
+import instrument
+import latex
+import tracing
 import os
+import re
 import time
 
 class Token:
@@ -23,187 +34,141 @@ class Token:
         return False
 
 # READERS
+# The whole source is held in memory, the lexer matches its tokens in place.
 class Reader:
-    def __init__(self) -> None:
+    def __init__(self, string:str = "") -> None:
+        self.string : str = string
         self.pos = 0
     def read_char(self) -> chr:
+        c = self.string[self.pos]
         self.pos += 1
+        return c
     def get_pos(self) -> int:
         return self.pos
     def set_pos(self, pos:int) -> None:
         self.pos = pos
     def is_eof(self) -> bool:
-        pass
+        return self.pos >= len(self.string)
 class StringReader(Reader):
     def __init__(self, string:str) -> None:
-        super().__init__()
-        self.string : str = string
-    def read_char(self) -> chr:
-        c = self.string[self.pos]
-        super().read_char()   
-        return c
-    def is_eof(self) -> bool:
-        return self.pos >= len(self.string)
+        super().__init__(string)
 
 class FileReader(Reader):
     def __init__(self, file) -> None:
-        super().__init__()
-        self.file = file
-    
-    def read_char(self) -> chr:
-        c = self.file.read(1)
-        super().read_char()
-        return c
-    
-    def set_pos(self, pos: int) -> None:
-        self.file.seek(pos)
-        super().set_pos(pos)
-    
-    def is_eof(self) -> bool:
-        c = self.file.read(1)
-        self.file.seek(self.pos)
-        return c == ""
+        super().__init__(file.read())
 
 class Lexer:
+    # one alternative per kind of token, tried in this order
+    TOKENS = re.compile(r"""
+        (?P<space>[ \n]+)
+        |(?P<comment>\#[^\n]*)
+        |(?P<number>[0-9]+)
+        |(?P<assign>:=)
+        |(?P<pile>::)
+        |(?P<lambda>[\\\u03BB])
+        |(?P<name>[^\W\d]\w*)
+        |(?P<path>"[^"]*")
+        |(?P<no_eval><-)
+        |(?P<syntax>[().;<>,\[\]=])
+        """, re.VERBOSE)
+
     def __init__(self, reader: Reader) -> None:
         self.reader: Reader = reader
-        self.state = 0
         self.line_no = 1
-        self.buffer = ""
-        self.digits = [str(i) for i in range(10)]
 
     def next_token(self) -> Token:
-        self.state = 0
-        self.buffer = ""
-        while True :
-            # INITIAL STATE
-            if self.state == 0:
-                # EOF
-                if self.reader.is_eof():
-                    return Token("EOF", None)
-                c = self.reader.read_char()
-                if c == ' ':
-                    continue
-                elif c == '\n':
-                    self.line_no +=1
-                elif c == '#':
-                    self.state = 1
-                elif c in self.digits:
-                    self.state = 2
-                    self.buffer = c
-                elif c == ':':
-                    self.state = 3
-                elif c == "\u03BB" or c == "\\":
-                    self.state = 6
-                elif c.isalpha() or c == '_':
-                    self.state = 4
-                    self.buffer = c
-                elif c == '"':
-                    self.state = 7
-                elif c == "<":
-                    self.state = 8
-                    self.buffer = c
-                else:
-                    self.state = 5
-            # COMMENTS
-            elif self.state == 1:
-                if not self.reader.is_eof():
-                    c = self.reader.read_char()
-                else:
+        string, pos = self.reader.string, self.reader.pos
+        while True:
+            m = Lexer.TOKENS.match(string, pos)
+            if m == None:
+                self.reader.pos = pos
+                if pos >= len(string):
                     return Token("EOF", None)
-                if c == '\n':
-                    self.line_no += 1
-                    self.state = 0
-            # NATURAL NUMBERS
-            elif self.state == 2:
-                if not self.reader.is_eof():
-                    c = self.reader.read_char()
-                    if c not in self.digits:
-                        self.reader.set_pos(self.reader.get_pos()-1) # go back one
-                        return Token(self.buffer, int(self.buffer), "NUMBER")
-                    else:
-                        self.buffer += c
-                else:
-                    return Token(self.buffer, int(self.buffer))
-            # ASSIGN or list pile
-            elif self.state == 3:
-                if not self.reader.is_eof():
-                    c = self.reader.read_char()
-                    if c == '=':
-                        return Token("ASSIGN", ":=")
-                    elif c == ':':
-                        return Token("::")
-                    else:
-                        # error
-                        self.state = -1
-                        self.buffer = ":"+c
-                else:
-                    # error
-                    self.state = -1
-                    self.buffer = c+"EOF"
-            # ASSIGN no eval
-            elif self.state == 8:
-                if not self.reader.is_eof():
-                    c = self.reader.read_char()
-                    if c == '-':
-                        return Token("ASSIGN_NO_EVAL", "<-")
-                    else:
-                        # backtrace and return "<"
-                        self.reader.set_pos(self.reader.get_pos()-1) # go back one
-                        return Token("<")
-                else:
-                    # error
-                    self.state = -1
-                    self.buffer = c+"EOF"
-            # KEYWORD
-            elif self.state == 4:
-                if not self.reader.is_eof():
-                    c = self.reader.read_char()
-                    if c not in self.digits and not c.isalpha() and c != '_':
-                        self.reader.set_pos(self.reader.get_pos()-1) # go back one
-                        return Token(self.buffer, None, "NAME")
-                    else:
-                        self.buffer += c
-                else:
-                    return Token(self.buffer, None, "NAME")
-            # SYNTAX
-            elif self.state == 5:
-                if c in "().;>,[]=":
-                    return Token(c, None)
-                else:
-                    # error
-                    self.state = -1
-                    self.buffer = c
-            # LAMBDA
-            elif self.state == 6:
+                if string[pos] == '"':
+                    raise ValueError(f"Path is malformed : {string[pos+1:]}")
+                buffer = string[pos]
+                if buffer == ":":
+                    buffer = string[pos:pos+2] if pos+1 < len(string) else ":EOF"
+                raise ValueError(f"Unknown char sequence '{buffer}' at {self.line_no}")
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "space":
+                self.line_no += m.group().count("\n")
+                continue
+            if kind == "comment":
+                continue
+            self.reader.pos = pos
+            if kind == "name":
+                return Token(m.group(), None, "NAME")
+            elif kind == "syntax":
+                return Token(m.group(), None)
+            elif kind == "number":
+                return Token(m.group(), int(m.group()), "NUMBER")
+            elif kind == "lambda":
                 return Token("LAMBDA", None)
-            # PATH
-            elif self.state == 7:
-                if not self.reader.is_eof():
-                    c = self.reader.read_char()
-                    if c == '"':
-                        return Token(self.buffer, self.buffer, "PATH")
-                    else:
-                        self.buffer += c
-                else:
-                    raise ValueError(f"Path is malformed : {self.buffer}")
+            elif kind == "assign":
+                return Token("ASSIGN", ":=")
+            elif kind == "pile":
+                return Token("::")
+            elif kind == "no_eval":
+                return Token("ASSIGN_NO_EVAL", "<-")
             else:
-                raise ValueError(f"Unknown char sequence '{self.buffer}' at {self.line_no}")
+                return Token(m.group()[1:-1], m.group()[1:-1], "PATH")
 class Parser:
-    def __init__(self, free_vars: dict = dict(), modules=set(), combinator = None) -> None:
+    COMMANDS = ("help", "clear", "exit", "listall", "showlastinfos", "verbose", "reduce", "cache", "print", "printnoeval", "latexexport", "defaultcombinator", "numerals", "budget", "continue", "stats", "trace")
+
+    def __init__(self, free_vars: dict = None, modules: set = None, combinator = None, definitions = None, normal_forms = None, record = None) -> None:
         self.lexer : Lexer = None
         self.EOF = Token("EOF", None)
         self.token = None
-        self.free_vars = free_vars  # {name:(term, recursive ?)}
-        self.modules = modules
+        self.free_vars = free_vars if free_vars != None else {}  # {name:(term, recursive ?)}
+        # alpha equivalence index of free_vars {hash:[names in definition order]}
+        if definitions == None:
+            definitions = {}
+            for name, (t, recursive) in self.free_vars.items():
+                definitions.setdefault(t.hash, []).append(name)
+        self.definitions = definitions
+        self.modules = modules if modules != None else set()
         self.verbose = False
+        # how the steps are written in verbose mode
+        self.trace = tracing.Trace()
         self.reduce_beta = True
         self.reduce_eta = False
+        self.engine = "rewrite"
+        # numbers as Numeral nodes instead of Church numerals
+        self.native_numerals = False
+        # limits of print and assignments (None when unlimited), and the
+        # evaluation they stopped: (term, assigned name or None, budget to
+        # extend when the engine starts again from the term or None when it
+        # resumes from it)
+        self.budget_steps = None
+        self.budget_seconds = None
+        self.budget_nodes = None
+        self.suspended = None
+        # instrumentation of the rewriting engine, and the profile of the
+        # last evaluation
+        self.profiling = False
+        self.last_profile = None
         self.combinator = combinator if combinator != None else self.turing_combinator()
+        # binders enclosing the parsed term: {name:[levels]} and their number
+        self.scope = {}
+        self.depth = 0
+        # normal forms of the evaluated terms
+        self.normal_forms = normal_forms if normal_forms != None else cache.NormalFormCache()
+        # what the module parsed by this parser does, for the import cache
+        self.record = record
 
         # last infos
         self.last_eval_time:float = 0.0
         self.last_reduction_number:int = 0
+        self.last_peak_nodes:int = None
+        self.last_interactions:int = None
+        self.last_parallel_tasks:int = None
+        self.last_budget_exhausted:str = None
+        # exhausted budget of an engine which gave back the original term
+        self.last_budget_restart = None
+        # reductions of all the evaluations
+        self.total_reductions:int = 0
 
 
     def listall(self):
@@ -223,19 +188,27 @@ class Parser:
 
     def parse(self, reader: Reader) -> None:
         self.lexer = Lexer(reader)
+        self.scope = {}
+        self.depth = 0
         self.token = self.lexer.next_token()
         self.L()
 
     # L -> I; L | EOF
     def L(self) -> None:
-        if self.token != self.EOF:
+        while self.token != self.EOF:
             # instruction
             self.I()
             self.match(Token(";", None))
-            self.L()
-    # I -> help | clear | exit | listall |showlastinfos | verbose {true | false } | reduce { both| beta | eta} | import path | printnoeval T
-    # print T | Name := T | Name <- T | defaultcombinator T | latexexport T path {eval | {steps | steps=n} | highlight | horizontal}
+    # I -> help | clear | exit | listall |showlastinfos | verbose {true | false } | reduce { both| beta | eta | nbe | machine | lazy | optimal} | import path | printnoeval T
+    # cache {clear | entries n | nodes n} | numerals {church | native}
+    # budget {none | steps n | time n | nodes n} | continue | stats {true | false | path}?
+    # trace {every n | size n | compact {true | false} | file path | console}
+    # print T | Name := T | Name <- T | defaultcombinator T | latexexport T path {eval | {steps | steps=n} | highlight | horizontal | every=n | first=n | last=n | split=n}
     def I(self) -> None:
+        # only definitions and imports can be replayed from the import cache
+        if self.token.type == "NAME" and self.token.name in Parser.COMMANDS:
+            if self.record != None:
+                self.record.pure = False
         if self.token.type == "NAME":
             # --built in keywords
             # help
@@ -253,14 +226,35 @@ class Parser:
                 print("clear; -> clear console output")
                 print("exit; -> quit interpreter")
                 print("listall; -> display all defined lambda terms")
-                print("showlastinfos; -> display last evaluation time and number of reductions")
+                print("showlastinfos; -> display last evaluation time, number of reductions and node sharing")
                 print("verbose true/false; -> show/hide evaluation steps")
+                print("trace every n; -> in verbose mode, show only every n-th step (1 by default)")
+                print("trace size n; -> in verbose mode, show only the steps changing the size of the term by n nodes or more (0 by default)")
+                print("trace compact true/false; -> show the contracted redex and its path instead of the whole term")
+                print("trace file \"path\"; / trace console; -> write the steps to a file / to the console (default)")
+                print("numerals church(default)/native; -> numbers as Church numerals or as native integers expanded only when applied,")
+                print("... with reduce nbe, succ, pred, iszero, add, sub, mult, exp and proj are computed directly")
+                print("budget steps/time/nodes n; -> stop print and assignments after n reductions, n seconds or terms of n nodes")
+                print("budget none; -> no budget (default)")
+                print("continue; -> resume the evaluation stopped by the budget, from the partially reduced term with reduce beta/eta/both/machine/parallel, the other engines start again with the budget added")
+                print("stats true/false; -> record counters and timings of the next evaluations with reduce beta/eta/both (slower)")
+                print("stats; -> display the counters and timings of the last evaluation, stats \"path\"; -> save them as JSON")
+                print("cache clear; -> forget the cached normal forms of the evaluated terms")
+                print("cache entries n; / cache nodes n; -> limit the number of cached normal forms / of their nodes")
                 print("reduce beta(default)/eta/both; -> evaluation strategy : leftmost outermost beta/eta reduction or both")
+                print("reduce nbe; -> beta normal form by evaluation (normalization by evaluation), much faster")
+                print("reduce machine; -> leftmost outermost beta reduction on an abstract machine, same number of reductions")
+                print("reduce lazy; -> call-by-need graph reduction, shared arguments are reduced only once")
+                print("reduce optimal; -> experimental optimal reduction on sharing graphs (Lamping), shared redexes are reduced only once")
+                print("reduce parallel; -> beta normal form with the long arguments of the head normal form normalized by a pool of processes")
+                print("... steps are always shown with leftmost outermost reduction in verbose mode or latex export")
                 print("defaultcombinator T; -> specify the default fixed point combinator (Turing by default)")
                 print("import \"path\"; -> load terms from file")
                 print("latexexport TERM \"path\" [eval | steps | highlight | horizontal]; -> export latex forest representation")
                 print("... steps -> all reductions steps")
                 print("... steps=n -> export only the n first reductions (n > 0)")
+                print("... every=k / first=n / last=n -> with steps, export only every k-th step / the n first / the n last steps (the normal form is always exported)")
+                print("... split=n -> with steps, write n steps per file (path_0.tex, path_1.tex, ...) and input them from path")
                 print("------------------------------")
             # clear
             elif self.token == Token("clear", None, "NAME"):
@@ -297,59 +291,217 @@ class Parser:
                     self.match(self.token)
                     self.reduce_beta = True
                     self.reduce_eta = False
+                    self.engine = "rewrite"
                 # reduce eta
                 elif self.token == Token("eta", None, "NAME"):
                     self.match(self.token)
                     self.reduce_eta = True
                     self.reduce_beta = False
+                    self.engine = "rewrite"
                 # reduce both
                 elif self.token == Token("both", None, "NAME"):
                     self.match(self.token)
                     self.reduce_eta = True
                     self.reduce_beta = True
+                    self.engine = "rewrite"
+                # reduce nbe
+                elif self.token == Token("nbe", None, "NAME"):
+                    self.match(self.token)
+                    self.reduce_beta = True
+                    self.reduce_eta = False
+                    self.engine = "nbe"
+                # reduce machine
+                elif self.token == Token("machine", None, "NAME"):
+                    self.match(self.token)
+                    self.reduce_beta = True
+                    self.reduce_eta = False
+                    self.engine = "machine"
+                # reduce lazy
+                elif self.token == Token("lazy", None, "NAME"):
+                    self.match(self.token)
+                    self.reduce_beta = True
+                    self.reduce_eta = False
+                    self.engine = "lazy"
+                # reduce optimal
+                elif self.token == Token("optimal", None, "NAME"):
+                    self.match(self.token)
+                    self.reduce_beta = True
+                    self.reduce_eta = False
+                    self.engine = "optimal"
+                # reduce parallel
+                elif self.token == Token("parallel", None, "NAME"):
+                    self.match(self.token)
+                    self.reduce_beta = True
+                    self.reduce_eta = False
+                    self.engine = "parallel"
+                else:
+                    raise ValueError(f"reduce expects 'beta' (default), 'eta', 'both', 'nbe', 'machine', 'lazy', 'optimal' or 'parallel'. Got {self.token.name}.")
+            # cache
+            elif self.token == Token("cache", None, "NAME"):
+                self.match(self.token)
+                if self.token == Token("clear", None, "NAME"):
+                    self.match(self.token)
+                    self.normal_forms.clear()
+                elif self.token == Token("entries", None, "NAME") or self.token == Token("nodes", None, "NAME"):
+                    limit = self.token.name
+                    self.match(self.token)
+                    if self.token.type != "NUMBER":
+                        raise ValueError(f"cache {limit} expects a number, got {self.token.name}.")
+                    n = self.token.value
+                    self.match(self.token)
+                    if limit == "entries":
+                        self.normal_forms.set_limits(max_entries=n)
+                    else:
+                        self.normal_forms.set_limits(max_nodes=n)
+                else:
+                    raise ValueError(f"cache expects 'clear', 'entries' or 'nodes'. Got {self.token.name}.")
+            # numerals
+            elif self.token == Token("numerals", None, "NAME"):
+                self.match(self.token)
+                if self.token == Token("church", None, "NAME"):
+                    self.match(self.token)
+                    self.native_numerals = False
+                elif self.token == Token("native", None, "NAME"):
+                    self.match(self.token)
+                    self.native_numerals = True
+                else:
+                    raise ValueError(f"numerals expects 'church' (default) or 'native'. Got {self.token.name}.")
+            # budget
+            elif self.token == Token("budget", None, "NAME"):
+                self.match(self.token)
+                if self.token == Token("none", None, "NAME"):
+                    self.match(self.token)
+                    self.budget_steps, self.budget_seconds, self.budget_nodes = None, None, None
+                elif self.token == Token("steps", None, "NAME") or self.token == Token("time", None, "NAME") or self.token == Token("nodes", None, "NAME"):
+                    limit = self.token.name
+                    self.match(self.token)
+                    if self.token.type != "NUMBER":
+                        raise ValueError(f"budget {limit} expects a number, got {self.token.name}.")
+                    n = self.token.value
+                    self.match(self.token)
+                    if limit == "steps":
+                        self.budget_steps = n
+                    elif limit == "time":
+                        self.budget_seconds = n
+                    else:
+                        self.budget_nodes = n
+                else:
+                    raise ValueError(f"budget expects 'none', 'steps', 'time' or 'nodes'. Got {self.token.name}.")
+            # trace
+            elif self.token == Token("trace", None, "NAME"):
+                self.match(self.token)
+                if self.token == Token("every", None, "NAME") or self.token == Token("size", None, "NAME"):
+                    option = self.token.name
+                    self.match(self.token)
+                    if self.token.type != "NUMBER":
+                        raise ValueError(f"trace {option} expects a number, got {self.token.name}.")
+                    n = self.token.value
+                    self.match(self.token)
+                    if option == "every":
+                        if n <= 0:
+                            raise ValueError(f"trace every expects a number > 0, got {n}.")
+                        self.trace.every = n
+                    else:
+                        self.trace.size_change = n
+                elif self.token == Token("compact", None, "NAME"):
+                    self.match(self.token)
+                    if self.token == Token("true"):
+                        self.match(self.token)
+                        self.trace.compact = True
+                    elif self.token == Token("false"):
+                        self.match(self.token)
+                        self.trace.compact = False
+                    else:
+                        raise ValueError(f"trace compact expects 'true' or 'false'. Got {self.token.name}.")
+                elif self.token == Token("file", None, "NAME"):
+                    self.match(self.token)
+                    if self.token.type != "PATH":
+                        raise ValueError(f"Expected a path name, got {self.token}")
+                    self.trace.close()
+                    self.trace.path = os.path.abspath(self.token.value)
+                    self.match(self.token)
+                elif self.token == Token("console", None, "NAME"):
+                    self.match(self.token)
+                    self.trace.close()
+                    self.trace.path = None
                 else:
-                    raise ValueError(f"reduce expects 'beta' (default), 'eta' or 'both'. Got {self.token.name}.")
+                    raise ValueError(f"trace expects 'every', 'size', 'compact', 'file' or 'console'. Got {self.token.name}.")
+            # stats
+            elif self.token == Token("stats", None, "NAME"):
+                self.match(self.token)
+                if self.token == Token("true"):
+                    self.match(self.token)
+                    self.profiling = True
+                elif self.token == Token("false"):
+                    self.match(self.token)
+                    self.profiling = False
+                elif self.token.type == "PATH":
+                    path = self.token.value
+                    self.match(self.token)
+                    if self.last_profile == None:
+                        raise ValueError("No recorded evaluation, use stats true; first.")
+                    self.last_profile.dump(path)
+                elif self.token == Token(";"):
+                    if self.last_profile == None:
+                        raise ValueError("No recorded evaluation, use stats true; first.")
+                    for line in self.last_profile.report():
+                        print(line)
+                else:
+                    raise ValueError(f"stats expects 'true', 'false', a path or nothing. Got {self.token.name}.")
+            # continue
+            elif self.token == Token("continue", None, "NAME"):
+                self.match(self.token)
+                if self.suspended == None:
+                    raise ValueError("No evaluation to continue.")
+                t, var_name, previous = self.suspended
+                self.suspended = None
+                limits = self.new_budget()
+                if previous != None and limits != None:
+                    # stopping again at the same point would not progress
+                    limits = previous.extend(limits)
+                t = self.eval_term(t, limits=limits)
+                self.finish(t, var_name)
             # print T
             elif self.token == Token("print", None, "NAME"):
                 self.match(self.token)
-                t, recursive = self.T([])
-                t = self.eval_term(t)
-                print(self.format_term(t))
+                t, recursive = self.T()
+                t = self.eval_term(t, limits=self.new_budget())
+                self.finish(t)
             # printnoeval T
             elif self.token == Token("printnoeval", None, "NAME"):
                 self.match(self.token)
-                t, recursive = self.T([])
+                t, recursive = self.T()
                 print(self.format_term(t))
             # import "path"
             elif self.token == Token("import", None, "NAME"):
                 self.match(self.token)
                 if self.token.type != "PATH":
                     raise ValueError(f"Expected a path name, got {self.token}")
-                path = self.token.value
+                written = self.token.value
                 self.match(self.token)
 
-                path = os.path.abspath(path) # convert to absolute
+                path = os.path.abspath(written) # convert to absolute
                 # check if file exist
                 if not os.path.exists(path):
                     raise ValueError(f"File {path} do not exist.")
+                if self.record != None:
+                    self.record.imported(written, path)
                 # check if not already imported and parse
                 if path not in self.modules:
-                    self.modules.add(path)
-                    # parse file content
-                    with open(path, "r") as f:
-                        Parser(self.free_vars, self.modules, self.combinator).parse(FileReader(f))
+                    self.add_module(path)
+                    self.import_module(path)
                     
             # defaultcombinator T
             elif self.token == Token("defaultcombinator"):
                 self.match(self.token)
-                t, recursive = self.T([])
+                t, recursive = self.T()
                 self.combinator = t
             # latexexport T "path" [eval steps highlight]
             elif self.token == Token("latexexport"):
                 self.match(self.token)
 
                 # get Term
-                t, recursive = self.T([])
+                t, recursive = self.T()
 
                 # get path
                 if self.token.type != "PATH":
@@ -360,12 +512,23 @@ class Parser:
 
                 # get options
                 opts = [Token("eval"), Token("steps"), Token("highlight"), Token("horizontal")]
+                # sampling of the steps and number of steps per file
+                sampling = {"every": None, "first": None, "last": None, "split": None}
                 eval = False
                 steps = False
                 highlight = False
                 horizontal = False
                 max_steps = -1
-                while self.token in opts:
+                while self.token in opts or (self.token.type == "NAME" and self.token.name in sampling):
+                    if self.token.name in sampling:
+                        option = self.token.name
+                        self.match(self.token)
+                        self.match(Token("="))
+                        if self.token.type != "NUMBER" or self.token.value <= 0:
+                            raise ValueError(f"{option} expects a number > 0. Got {self.token.name}")
+                        sampling[option] = self.token.value
+                        self.match(self.token)
+                        continue
                     if self.token == opts[0]:
                         eval = True
                         self.match(self.token)
@@ -390,11 +553,15 @@ class Parser:
                         self.match(self.token)
 
                 # export latex
+                if eval and steps:
+                    export = latex.LatexExport(path, highlight, horizontal, **sampling)
+                    try:
+                        self.eval_term(t, export, max_steps=max_steps)
+                    finally:
+                        export.close()
+                    return
                 with open(path, "w") as f:
-                    if eval and steps:
-                        t = self.eval_term(t, f, highlight, horizontal, max_steps=max_steps)
-                        return
-                    elif eval:
+                    if eval:
                         t = self.eval_term(t)
                     
                     f.write("\\begin{forest}\n")
@@ -402,7 +569,7 @@ class Parser:
                         f.write("for tree={grow=east, s sep=3mm}\n")
                     else:
                         f.write("for tree={s sep=3mm}\n")
-                    f.write("["+t.latex_forest_format(highlight)+"]\n")
+                    f.write("["+t.latex_forest_format(True, highlight)+"]\n")
                     f.write("\\end{forest}")
                     if horizontal:
                         f.write("\\\\")
@@ -424,85 +591,118 @@ class Parser:
                     raise ValueError(f"Expected ':=' or '<-', got '{self.token.name}'")
 
                 vrecurse = term.Variable("v")
-                t, recursive = self.T([], var_name, vrecurse)
+                t, recursive = self.T(var_name, vrecurse)
 
                 if recursive:
                     t = term.Abstract(vrecurse, t)
                     t = term.Apply(self.combinator.copy(), t)
-                    self.free_vars[var_name] = (t, True)
+                    self.define(var_name, t, True)
                 elif no_eval:
-                    self.free_vars[var_name] = (t, False)
+                    self.define(var_name, t, False)
                 else:
                     #eval
-                    t = self.eval_term(t)
-                    self.free_vars[var_name] = (t, False)
+                    t = self.eval_term(t, limits=self.new_budget())
+                    self.finish(t, var_name)
         else:
             raise ValueError(f"Language keyword or variable name expected, got {self.token.name}.")
 
-    # OP Apply 
     # T -> R {R*}
-    def T(self, context, recurse_name : str = None, recurse_var:term.Variable = None):
-        context = context[:]
-        e, recurse = self.R(context, recurse_name, recurse_var)
-        while self.token == Token("(", None) or self.token == Token("<", None) or self.token == Token("[", None)  or self.token.type == "NAME" or self.token.type == "NUMBER":
-            etmp, recursetmp = self.R(context, recurse_name, recurse_var)
-            recurse = recurse or recursetmp
-            e = term.Apply(e, etmp)
-        return e, recurse
-
     # R -> E | E :: R
-    def R(self, context, recurse_name : str = None, recurse_var:term.Variable = None):
-        context = context[:]
-        e, recurse = self.E(context, recurse_name, recurse_var)
-        if self.token == Token("::"):
-            self.match(self.token)
-            r, recursetmp = self.R(context, recurse_name, recurse_var)
-            recurse = recurse or recursetmp
-            e = self.list_pile(e, r)
-        return (e, recurse)
-
     # E -> (T) | Name | Num | \ {Name+} . T | <T {(, T)+}> | [{T? (, T)+}]
-    def E(self, context, recurse_name : str = None, recurse_var:term.Variable = None):
-        context = context[:]
-        # tuple
-        if self.token == Token("<", None):
-            self.match(self.token)
-            tmp, recurse = self.T(context, recurse_name, recurse_var)
-            t = [tmp]
-            while self.token == Token(",", None):
+    # Parsed with an explicit stack instead of recursing at each nesting of
+    # parentheses, binders, tuples and lists. Every T being read has a
+    # frame [construct it is the body of, application read so far, heads
+    # of the pending E :: R, recursive ?], the construct being None for the
+    # outermost T, ("paren",), ("lambda", vars), ("tuple", items) or
+    # ("list", items).
+    def T(self, recurse_name : str = None, recurse_var:term.Variable = None):
+        stack = [[None, None, [], False]]
+        while True:
+            # E, or the opening of a construct whose T is read first
+            if self.token == Token("<", None):
                 self.match(self.token)
-                tmp, recursetmp = self.T(context, recurse_name, recurse_var)
-                recurse = recurse or recursetmp
-                t.append(tmp)
-            self.match(Token(">", None))
-            return self.gen_tuple(t), recurse
-        elif self.token == Token("["):
-            self.match(self.token)
-            # empty list
-            if self.token == Token("]"):
+                stack.append([("tuple", []), None, [], False])
+                continue
+            elif self.token == Token("["):
+                self.match(self.token)
+                # empty list
+                if self.token == Token("]"):
+                    self.match(self.token)
+                    e, recurse = self.gen_list([]), False
+                else:
+                    stack.append([("list", []), None, [], False])
+                    continue
+            elif self.token == Token("(", None):
                 self.match(self.token)
-                return self.gen_list([]), False
-            # read list
-            tmp, recurse = self.T(context, recurse_name, recurse_var)
-            t = [tmp]
-            while self.token == Token(",", None):
+                stack.append([("paren",), None, [], False])
+                continue
+            elif self.token == Token("LAMBDA", None):
                 self.match(self.token)
-                tmp, recursetmp = self.T(context, recurse_name, recurse_var)
-                recurse = recurse or recursetmp
-                t.append(tmp)
-            self.match(Token("]", None))
-            return self.gen_list(t), recurse
-        elif self.token == Token("(", None):
-            self.match(self.token)
-            t, recurse = self.T(context, recurse_name, recurse_var)
-            self.match(Token(")", None))
-            return t, recurse
-        elif self.token.type == "NAME":
-            # if var is in the context
-            for v in context:
-                if v.name == self.token.name:
-                    self.match(self.token)
-                    return v, False
+                if self.token.type != "NAME":
+                    raise ValueError(f"Expected a variable name after lambda, got {self.token.name}")
+                # get list of vars
+                vars = []
+                while self.token.type == "NAME":
+                    vars.append(term.Variable(self.token.name))
+                    self.match(self.token)
+                self.match(Token(".", None))
+                for v in vars:
+                    self.scope.setdefault(v.name, []).append(self.depth)
+                    self.depth += 1
+                stack.append([("lambda", vars), None, [], False])
+                continue
+            else:
+                e, recurse = self.E(recurse_name, recurse_var)
+            while True:
+                frame = stack[-1]
+                frame[3] = frame[3] or recurse
+                if self.token == Token("::"):
+                    self.match(self.token)
+                    frame[2].append(e)
+                    break
+                # right associative
+                for h in reversed(frame[2]):
+                    e = self.list_pile(h, e)
+                frame[2] = []
+                frame[1] = e if frame[1] == None else term.Apply(frame[1], e)
+                if self.token == Token("(", None) or self.token == Token("<", None) or self.token == Token("[", None) or self.token.type == "NAME" or self.token.type == "NUMBER":
+                    break
+                # end of the T of frame
+                construct, t, recurse = frame[0], frame[1], frame[3]
+                if construct == None:
+                    return t, recurse
+                stack.pop()
+                if construct[0] == "tuple" or construct[0] == "list":
+                    construct[1].append(t)
+                    if self.token == Token(",", None):
+                        self.match(self.token)
+                        stack.append([construct, None, [], recurse])
+                        break
+                    if construct[0] == "tuple":
+                        self.match(Token(">", None))
+                        e = self.gen_tuple(construct[1])
+                    else:
+                        self.match(Token("]", None))
+                        e = self.gen_list(construct[1])
+                elif construct[0] == "paren":
+                    self.match(Token(")", None))
+                    e = t
+                else:
+                    # construct abstraction chain, the body is already indexed
+                    for v in reversed(construct[1]):
+                        self.depth -= 1
+                        self.scope[v.name].pop()
+                        t = term.Abstract(v, t, True)
+                    e = t
+
+    # Name | Num
+    def E(self, recurse_name : str = None, recurse_var:term.Variable = None):
+        if self.token.type == "NAME":
+            # if var is bound, by the innermost binder of this name
+            levels = self.scope.get(self.token.name)
+            if levels:
+                self.match(self.token)
+                return term.Variable(None, self.depth-1-levels[-1]), False
             # if var is the assignation -> recursuve function
             if self.token.name == recurse_name:
                 self.match(self.token)
@@ -510,6 +710,8 @@ class Parser:
             # if var is a declared free variable -> capture value
             if self.token.name in self.free_vars:
                 t, recurse = self.free_vars[self.token.name]
+                if self.record != None:
+                    self.record.use(self.token.name, t)
                 self.match(self.token)
                 return t.copy(), False
             else:
@@ -518,32 +720,14 @@ class Parser:
             n = self.gen_number(self.token.value)
             self.match(self.token)
             return n, False
-        elif self.token == Token("LAMBDA", None):
-            self.match(self.token)
-            if self.token.type == "NAME":
-                # get list of vars
-                vars = [term.Variable(self.token.name)]
-                self.match(self.token)
-                while self.token.type == "NAME":
-                    vars.append(term.Variable(self.token.name))
-                    self.match(self.token)
-                self.match(Token(".", None))
-                context = context+vars
-                # keep only the last occurence of duplicate variables
-                context = list({v.name:v for v in context}.values())
-                t, recurse = self.T(context, recurse_name, recurse_var) # get abstracted body
-                # construct abstraction chain
-                vars.reverse()
-                for v in vars:
-                    t = term.Abstract(v, t)
-                return t, recurse
         else:
             raise ValueError(f"Unknown term structure, got {self.token}")
 
     def get_number(self, t):
+        if t.type == term.TermType.NUMERAL:
+            return t.value
         if t.type != term.TermType.ABSTRACT:
             return None
-        ab1 = t
         # second abstract
         if t.right.type != term.TermType.ABSTRACT:
             return None
@@ -554,21 +738,18 @@ class Parser:
         t = ab2.right
         n = 0
         while t.type == term.TermType.APPLY:
-            if t.left != ab1.var:
+            if t.left.type != term.TermType.VARIABLE or t.left.index != 1:
                 return None
             n += 1
             t = t.right
-        if t == ab2.var:
+        if t.type == term.TermType.VARIABLE and t.index == 0:
                 return n
         return None
 
     def gen_number(self, n):
-        f = term.Variable("f")
-        x = term.Variable("x")
-        t = x
-        for i in range(n):
-            t = term.Apply(f, t)
-        return term.Abstract(f, term.Abstract(x, t))
+        if self.native_numerals:
+            return term.Numeral(n)
+        return term.church(n)
 
     def turing_combinator(self):
         a = term.Variable("a")
@@ -592,112 +773,288 @@ class Parser:
         return term.Abstract(f, term.Apply(term.term.Abstract(x1, term.term.Apply(f, term.term.Abstract(v1, term.term.Apply(term.term.Apply(x1,x1),v1)))), term.term.Abstract(x2, term.term.Apply(f, term.term.Abstract(v2, term.term.Apply(term.term.Apply(x2,x2),v2))))))
 
     def show_last_infos(self):
-        print(f"Last evaluation took {self.last_eval_time}s for {self.last_reduction_number} reductions.")
+        infos = f"Last evaluation took {self.last_eval_time}s for {self.last_reduction_number} reductions"
+        if self.last_peak_nodes != None:
+            infos += f", peak of {self.last_peak_nodes} nodes"
+        if self.last_interactions != None:
+            infos += f", {self.last_interactions} interactions"
+        if self.last_parallel_tasks != None:
+            infos += f", {self.last_parallel_tasks} arguments normalized in parallel"
+        print(infos+".")
+        c = self.normal_forms
+        print(f"Normal form cache: {len(c.entries)} entries, {c.nodes} nodes, {c.hits} hits, {c.misses} misses.")
+        live, hit_rate = term.Term.interning_stats()
+        print(f"{live} live shared nodes, {round(100*hit_rate, 1)}% of the constructed nodes already existed.")
 
     def gen_tuple(self, L):
-        x = term.Variable("x")
-        t = x
-        for e in L:
-            t = term.Apply(t, e)
-        return term.Abstract(x, t)
+        return term.tuple_term(L)
 
     def get_tuple(self, t:term.Term):
+        # elements live under the tuple binder
+        if t.items != None:
+            return t.items
         if t.type != term.TermType.ABSTRACT:
             return None
-        v = t.var
         next = t.right
         L = []
         while next.type == term.TermType.APPLY:
             L.append(next.right)
             next = next.left
-        if next == v:
+        if next.type == term.TermType.VARIABLE and next.index == 0:
             L.reverse()
             return tuple(L) if len(L) > 0 else None
         return None
 
     def list_pile(self, h, t):
-        x = term.Variable("x")
-        y = term.Variable("y")
-        return term.Abstract(x, term.Abstract(y, term.Apply( term.Apply(x, h), t)))
+        return term.cons(h, t)
 
     def gen_list(self, L):
-        x = term.Variable("x")
-        y = term.Variable("y")
-        t = term.Abstract(x, term.Abstract(y, y)) # empty list
+        t = term.nil()
         for e in reversed(L):
             t = self.list_pile(e, t)
         return t
 
     def get_list(self, t:term.Term):
+        # each element lives under the binders of every cell before it,
+        # returns the elements with their depth in cells
         L = []
+        depth = 0
         while True:
             # \x y .
             if t.type != term.TermType.ABSTRACT:
                 return None
-            var1 = t.var
             t = t.right
             if t.type != term.TermType.ABSTRACT:
                 return None
-            var2 = t.var
             t = t.right
+            depth += 1
             # \x y . y
-            if t == var2:
+            if t.type == term.TermType.VARIABLE and t.index == 0:
                 return L
             elif t.type != term.TermType.APPLY:
                 return None
             elif t.left.type != term.TermType.APPLY:
                 return None
-            elif t.left.left != var1:
+            elif t.left.left.type != term.TermType.VARIABLE or t.left.left.index != 1:
                 return None
             # \x y . x H T
             else:
-                L.append(t.left.right)
+                L.append((t.left.right, depth))
                 t = t.right
 
+    def define(self, name:str, t:term.Term, recursive:bool):
+        names = self.definitions.setdefault(t.hash, [])
+        if name in self.free_vars:
+            # a redefinition keeps its place in free_vars
+            self.definitions[self.free_vars[name][0].hash].remove(name)
+            order = list(self.free_vars)
+            k = 0
+            while k < len(names) and order.index(names[k]) < order.index(name):
+                k += 1
+            names.insert(k, name)
+        else:
+            names.append(name)
+        self.free_vars[name] = (t, recursive)
+        if self.record != None:
+            self.record.define(name, t, recursive)
+
+    def add_module(self, path:str):
+        self.modules.add(path)
+
+    def import_module(self, path:str):
+        parser = Parser(self.free_vars, self.modules, self.combinator, self.definitions, self.normal_forms)
+        parser.native_numerals = self.native_numerals
+        mode = (parser.engine, parser.reduce_beta, parser.reduce_eta, parser.native_numerals)
+        if self.replay_module(parser, path, mode):
+            return
+        # parse file content
+        parser.record = cache.ModuleRecord(path)
+        with open(path, "r") as f:
+            parser.parse(FileReader(f))
+        if parser.record.pure:
+            cache.save_module(parser.record, mode, self.combinator)
+
+    def replay_module(self, parser, path:str, mode) -> bool:
+        # replays the cached actions of a module, its imports from their own
+        # cache. Returns False when a definition it used has changed (terms
+        # are hash-consed, unchanged definitions are the same nodes) or an
+        # import resolves to another file than when it was recorded, the
+        # module is then parsed again
+        cached = cache.load_module(path, mode)
+        if cached == None:
+            return False
+        actions, external, combinator = cached
+        if combinator is not self.combinator:
+            return False
+        checks = {}
+        for name, t, k in external:
+            checks.setdefault(k, []).append((name, t))
+        for k in range(len(actions)+1):
+            for name, t in checks.get(k, ()):
+                if name not in self.free_vars or t is not self.free_vars[name][0]:
+                    return False
+            if k == len(actions):
+                return True
+            if actions[k][0] == "import":
+                # resolved again as the import command does
+                m = os.path.abspath(actions[k][1])
+                if m != actions[k][2] or not os.path.exists(m):
+                    return False
+                if m not in self.modules:
+                    self.add_module(m)
+                    self.import_module(m)
+            else:
+                kind, name, t, recursive = actions[k]
+                parser.define(name, t, recursive)
+
     def get_free_var(self, t:term.Term) -> str:
-        for v in self.free_vars:
+        # first definition alpha equivalent to t
+        for v in self.definitions.get(t.hash, ()):
             if t.is_equals(self.free_vars[v][0]):
                 return v
         return None
         
-    def format_term(self, t:term.Term) -> str:
-        # check if exist
-        f = self.get_free_var(t)
-        if f != None:
-            return f
-        # check if number
-        n = self.get_number(t)
-        if n != None:
-            return str(n)
-        # check tuple
-        tp = self.get_tuple(t)
-        if tp != None:
-            if len(tp) == 0:
-                return "<>"
-            buffer = "<"
-            for i in tp:
-                buffer += self.format_term(i)+","
-            return buffer[:-1]+">"
-        # check list
-        li = self.get_list(t)
-        if li != None:
-            buffer = "["
-            for i in li:
-                buffer += self.format_term(i)+","
-            return buffer[:-1]+"]"
-        # unknown
-        return str(t)
-
-    def eval_term(self, t: term.Term, latex_export_file=None, highlight = False, horizontal = False, max_steps=-1) -> term.Term:
+    def format_term(self, t:term.Term, context = None) -> str:
+        # context holds the names of the binders enclosing t. Defined terms,
+        # numbers, tuples and lists are recognized at the root and down the
+        # elements of tuples and lists, the rest is written by
+        # Term.write_text, all in one pass into a single buffer.
+        context = list(context) if context != None else []
+        out = []
+        # a string is written, a tuple of names enters binders and a number
+        # leaves that many binders
+        todo = [t]
+        while len(todo) > 0:
+            t = todo.pop()
+            if isinstance(t, str):
+                out.append(t)
+                continue
+            if isinstance(t, int):
+                del context[len(context)-t:]
+                continue
+            if isinstance(t, tuple):
+                context.extend(t)
+                continue
+            # check if exist
+            f = self.get_free_var(t)
+            if f != None:
+                out.append(f)
+                continue
+            # check if number
+            n = self.get_number(t)
+            if n != None:
+                out.append(str(n))
+                continue
+            # check tuple
+            tp = self.get_tuple(t)
+            if tp != None:
+                out.append("<")
+                todo += [1, ">"]
+                for k in range(len(tp)-1, -1, -1):
+                    todo.append(tp[k])
+                    if k > 0:
+                        todo.append(",")
+                todo.append((t.var.name,))
+                continue
+            # check list
+            li = self.get_list(t)
+            if li != None:
+                out.append("[")
+                # each element is under the binders of its cell and of the
+                # cells before it
+                cells = []
+                cell = t
+                for i in range(len(li)):
+                    cells.append((cell.var.name, cell.right.var.name))
+                    cell = cell.right.right.right
+                todo += [2*len(li), "]"]
+                for k in range(len(li)-1, -1, -1):
+                    todo.append(li[k][0])
+                    todo.append(cells[k])
+                    if k > 0:
+                        todo.append(",")
+                continue
+            # unknown
+            t.write_text(out, context)
+        return "".join(out)
+
+    def new_budget(self):
+        if self.budget_steps == None and self.budget_seconds == None and self.budget_nodes == None:
+            return None
+        return budget.Budget(self.budget_steps, self.budget_seconds, self.budget_nodes)
+
+    def finish(self, t: term.Term, var_name: str = None):
+        # print or assign an evaluated term, or keep it for continue; when
+        # its evaluation ran out of budget
+        if self.last_budget_exhausted != None:
+            self.suspended = (t, var_name, self.last_budget_restart)
+            if self.last_budget_restart != None:
+                print(f"Evaluation stopped after {self.last_reduction_number} reductions (budget of {self.last_budget_exhausted} exhausted), continue; starts it again with the budget added.")
+            else:
+                print(f"Evaluation stopped after {self.last_reduction_number} reductions (budget of {self.last_budget_exhausted} exhausted), continue; resumes it.")
+        elif var_name == None:
+            print(self.format_term(t))
+        else:
+            self.define(var_name, t, False)
+
+    def eval_term(self, t: term.Term, latex_export=None, max_steps=-1, limits=None) -> term.Term:
+        # out of budget (limits), the rewriting engine and the machine give
+        # the partially reduced term and the other engines give back t
         start_time = time.time()
-        if self.reduce_beta and self.reduce_eta:
-            t, n = t.reduce(self.verbose, latex_export_file, highlight, horizontal, max_steps=max_steps)
-        elif self.reduce_beta:
-            t, n = t.beta_reduce(self.verbose, latex_export_file, highlight, horizontal, max_steps=max_steps)
-        elif self.reduce_eta:
-            t, n = t.eta_reduce(self.verbose, latex_export_file, highlight, horizontal, max_steps=max_steps)
+        stats = {"peak_size": None, "interactions": None, "tasks": None}
+        # the reduction steps must be shown again, they are not cached, and
+        # a profiled evaluation is measured again
+        cached = not self.verbose and latex_export == None and not self.profiling
+        profile = None
+        if self.profiling:
+            profile = instrument.Profile()
+            stats["profile"] = profile
+            profile.start()
+        mode = (self.engine, self.reduce_beta, self.reduce_eta, self.native_numerals, max_steps)
+        entry = self.normal_forms.get(mode, t) if cached else None
+        source = t
+        restart = None
+        try:
+            if entry != None:
+                t, n, stats = entry
+            # reduction steps can only be shown by rewriting the term
+            elif self.engine == "nbe" and not self.verbose and latex_export == None:
+                t, n = nbe.normalize(t, self.native_numerals, limits)
+            elif self.engine == "machine" and not self.verbose and latex_export == None:
+                t, n = machine.normalize(t.expand_numerals(), max_steps, limits)
+            elif self.engine == "lazy" and not self.verbose and latex_export == None:
+                t, n, stats["peak_size"] = lazy.normalize(t.expand_numerals(), limits)
+            elif self.engine == "optimal" and not self.verbose and latex_export == None:
+                t, n, stats["interactions"] = optimal.normalize(t.expand_numerals(), limits)
+            elif self.engine == "parallel" and not self.verbose and latex_export == None:
+                t, n, stats["tasks"] = parallel.normalize(t.expand_numerals(), budget=limits)
+            elif self.reduce_beta and self.reduce_eta:
+                t, n = t.reduce(self.verbose, latex_export, max_steps=max_steps, stats=stats, budget=limits, trace=self.trace)
+            elif self.reduce_beta:
+                t, n = t.beta_reduce(self.verbose, latex_export, max_steps=max_steps, stats=stats, budget=limits, trace=self.trace)
+            elif self.reduce_eta:
+                t, n = t.eta_reduce(self.verbose, latex_export, max_steps=max_steps, stats=stats, budget=limits, trace=self.trace)
+        except budget.BudgetExceeded as e:
+            n = e.args[0]
+            restart = limits
+        finally:
+            if profile != None:
+                profile.stop()
+        if profile != None:
+            self.last_profile = profile
+        self.last_budget_exhausted = limits.reason if limits != None else None
+        self.last_budget_restart = restart
+        if self.last_budget_exhausted != None:
+            # not a normal form
+            cached = False
+        if cached and entry == None:
+            self.normal_forms.put(mode, source, (t, n, stats))
         self.last_eval_time = time.time() - start_time
         self.last_reduction_number = n
+        self.total_reductions += n
+        self.last_peak_nodes = stats["peak_size"]
+        self.last_interactions = stats["interactions"]
+        self.last_parallel_tasks = stats["tasks"]
         if self.verbose:
             self.show_last_infos()
         return t
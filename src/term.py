@@ -1,165 +1,223 @@
 from enum import Enum
+import time
+import weakref
 
 class TermType(Enum):
     ABSTRACT = 1
     APPLY = 2
     VARIABLE = 3
+    NUMERAL = 4
     
 class Term:
-    def __init__(self, left, right, type):
-        self.left = left
-        self.right = right
-        self.type = type
-
-    def beta_reduce(self, verbose=False, latex_export_file=None, highlight = False, horizontal = False, n = 0, only_method = True, max_steps=-1):
-        old, next = self, self
-        n = 0
-        if verbose:
-            print(f"{n} -> {old}")
-        while True:
-            if n >= max_steps+1 and max_steps >= 0:
-                break
-            next, beta_reduced = old.one_step_beta_reduce()
-            if not beta_reduced:
-                if latex_export_file != None:
-                    self.write_latex_step(old, latex_export_file, n, False, False, horizontal, True)
-                break
-            elif latex_export_file != None:
-                self.write_latex_step(old, latex_export_file, n, True, highlight, horizontal, False)
-                self.write_latex_sep(latex_export_file, True, horizontal)
-            old = next
-            n += 1
-            if verbose:
-                print(f"{n} -b> {next}")
-        return (old, n)
-
-    def eta_reduce(self, verbose=False, latex_export_file=None, highlight = False, horizontal = False, max_steps=-1):
-        old, next = self, self
+    # Nodes have no __dict__, their fields are slots (the weak reference
+    # slot is used by the intern table) and each kind of node only has the
+    # slots it uses: the type and the missing children are class attributes.
+    __slots__ = ("loose", "named", "size", "depth", "free", "has_beta", "has_eta", "hash", "__weakref__")
+    left = None
+    right = None
+    # elements of a tuple λx.x a1 ... an (as they are under the binder),
+    # known for the terms built by tuple_term
+    items = None
+
+    # Hash consing: nodes are immutable and built once, the constructors
+    # look them up in a table of weak references so structurally identical
+    # subterms are the same object, and unused ones are still collected.
+    # Binder names are part of the key since they are printed, named
+    # variables are compared by identity and never shared.
+    table = weakref.WeakValueDictionary()
+    hits = 0
+    misses = 0
+    # variable occurrences replaced by contract_beta
+    substituted = 0
+
+    @staticmethod
+    def lookup(key):
+        t = Term.table.get(key)
+        if t is None:
+            Term.misses += 1
+        else:
+            Term.hits += 1
+        return t
+
+    @staticmethod
+    def interning_stats():
+        # live interned nodes and the ratio of constructions which found an
+        # existing node
+        total = Term.hits+Term.misses
+        return (len(Term.table), Term.hits/total if total > 0 else 0.0)
+
+    def init(self):
+        # de Bruijn metadata: 1 + highest loose index (0 when closed)
+        # and whether a named (not yet bound) variable occurs
+        self.loose = 0
+        self.named = False
+        # number of nodes of the tree (shared subterms counted each time)
+        # and length of its longest branch
+        self.size = 1
+        self.depth = 1
+        # bitmap of the loose indices: bit i is set when index i occurs
+        self.free = 0
+        # whether a beta (or eta) redex occurs in the tree
+        self.has_beta = False
+        self.has_eta = False
+        # structural hash, the same for alpha equivalent terms
+        self.hash = 0
+
+    def beta_reduce(self, verbose=False, latex_export=None, n = 0, only_method = True, max_steps=-1, stats=None, budget=None, trace=None):
+        return self.normal_order(True, False, verbose, latex_export, max_steps, stats, budget, trace)
+
+    def eta_reduce(self, verbose=False, latex_export=None, max_steps=-1, stats=None, budget=None, trace=None):
+        return self.normal_order(False, True, verbose, latex_export, max_steps, stats, budget, trace)
+    
+    def reduce(self, verbose=False, latex_export=None, max_steps=-1, stats=None, budget=None, trace=None):
+        return self.normal_order(True, True, verbose, latex_export, max_steps, stats, budget, trace)
+
+    def normal_order(self, beta, eta, verbose, latex_export, max_steps, stats, budget=None, trace=None):
+        # Leftmost outermost reduction, beta redexes first when both are
+        # reduced. The term is kept as a zipper: the focus on the last
+        # contracted position and the path of the original parents above it.
+        # No redex comes before the focus in preorder, so the search resumes
+        # from it and only the parent has to be checked again after a step.
+        focus, path = self, None
         n = 0
-        if verbose:
-            print(f"{n} -> {old}")
+        size = self.size
+        # instrumentation (see instrument.Profile), None when not profiled
+        profile = stats.get("profile") if stats != None else None
+        if stats != None:
+            stats["peak_size"] = size
+        if profile != None:
+            clock = time.perf_counter()
+        # in verbose mode the steps go through a tracing.Trace, every step
+        # to the console by default
+        if verbose and trace == None:
+            import tracing
+            trace = tracing.Trace()
+        if not verbose:
+            trace = None
+        if trace != None:
+            trace.start(self)
+        if profile != None:
+            profile.printing_time += time.perf_counter()-clock
+        # true when there is no beta redex left (or when only eta reducing)
+        beta_free = not beta
         while True:
             if n >= max_steps+1 and max_steps >= 0:
                 break
-            next, eta_reduce = old.one_step_eta_reduce()
-            if not eta_reduce:
-                if latex_export_file != None:
-                    self.write_latex_step(old, latex_export_file, n, False, False, horizontal, True)
+            if profile != None:
+                clock = time.perf_counter()
+            found = False
+            if not beta_free:
+                focus, path, found = self.locate(focus, path, True)
+                beta_free = not found
+            is_beta = found
+            if not found and eta:
+                # after the last beta step the focus is the whole term, a
+                # beta step can make an eta redex anywhere above it
+                focus, path, found = self.locate(focus, path, False)
+            if profile != None:
+                profile.search_time += time.perf_counter()-clock
+                clock = time.perf_counter()
+            if not found:
+                if latex_export != None:
+                    latex_export.end(n, self.rebuild_path(focus, path))
+                    if profile != None:
+                        profile.printing_time += time.perf_counter()-clock
                 break
-            elif latex_export_file != None:
-                self.write_latex_step(old, latex_export_file, n, False, highlight, horizontal, False)
-                self.write_latex_sep(latex_export_file, False, horizontal)
-            old = next
-            n += 1
-            if verbose:
-                print(f"{n} -e> {next}")
-        return (old, n)
-    
-    def reduce(self, verbose=False, latex_export_file=None, highlight = False, horizontal = False, max_steps=-1):
-        old, next = self, self
-        n = 0
-        if verbose:
-            print(f"{n} -> {old}")
-        while True:
-            if n >= max_steps+1 and max_steps >= 0:
+            elif latex_export != None:
+                latex_export.step(n, self.rebuild_path(focus, path), is_beta, path)
+                if profile != None:
+                    profile.printing_time += time.perf_counter()-clock
+            # out of budget, the partially reduced term is returned
+            if budget != None and budget.exceeded(n, size):
                 break
-            next, beta_reduced = old.one_step_beta_reduce()
-            if not beta_reduced:
-                next, eta_reduced = old.one_step_eta_reduce()
-                if not eta_reduced:
-                    if latex_export_file != None:
-                        self.write_latex_step(old, latex_export_file, n, False, False, horizontal, True)
-                    break
-                elif latex_export_file != None:
-                    self.write_latex_step(old, latex_export_file, n, False, highlight, horizontal, False)
-                    self.write_latex_sep(latex_export_file, False, horizontal)
-            elif latex_export_file != None:
-                self.write_latex_step(old, latex_export_file, n, True, highlight, horizontal, False)
-                self.write_latex_sep(latex_export_file, True, horizontal)
-            old = next
+            redex, redex_path = focus, path
+            if profile != None:
+                clock = time.perf_counter()
+            # contract
+            size -= focus.size
+            focus = focus.contract_beta() if is_beta else focus.contract_eta()
+            size += focus.size
             n += 1
-            if verbose:
-                print(str(n)+(" -b> " if beta_reduced else " -e> ")+str(next))
-        return (old, n)
-
-    def write_latex_sep(self, f, beta, horizontal):
-        symb = "beta" if beta else "eta"
-        if horizontal:
-            f.write("$\\big\\downarrow_{\\"+symb+"}$\\\\")
-        else:
-            f.write("$\\longrightarrow_{\\"+symb+"}$")
-        f.write("\n")
-
-    def write_latex_step(self,t, f, n, beta, highlight, horizontal, end = False):
-        if end:
-            info_reduce = ""
-        else:
-            info_reduce = "(beta)" if beta else "(eta)"
-        f.write(f"% step {n} {info_reduce}\n")
-        f.write("\\begin{forest}\n")
-        f.write("for tree={"+("grow=east," if horizontal else "")+"outer sep=0}\n")
-        f.write("["+t.latex_forest_format(beta, highlight)+"]\n")
-        f.write("\\node at (current bounding box.south) [below=1ex]{\emph{step "+str(n)+"}};\n")
-        f.write("\\end{forest}"+("\\\\" if horizontal else ""))
-        f.write("\n")
-            
+            if profile != None:
+                profile.substitution_time += time.perf_counter()-clock
+            # only the parent can become a redex before the focus, or the
+            # binder above an argument eta reduced to a variable
+            if path != None:
+                parent, side, up = path
+                if beta and parent.type == TermType.APPLY and side == 0 and (focus.type == TermType.ABSTRACT or focus.type == TermType.NUMERAL):
+                    focus, path = self.plug(parent, side, focus), up
+                    beta_free = False
+                elif eta and not is_beta:
+                    above = self.plug(parent, side, focus)
+                    if parent.type == TermType.APPLY and side == 1 and up != None:
+                        parent, side, up = up
+                        above = self.plug(parent, side, above)
+                    if above.type == TermType.ABSTRACT and above.is_eta_redex():
+                        focus, path = above, up
+            if stats != None and size > stats["peak_size"]:
+                stats["peak_size"] = size
+            if profile != None:
+                profile.step(self.rebuild_path(focus, path), redex_path)
+                clock = time.perf_counter()
+            if trace != None:
+                trace.step(n, is_beta, redex, redex_path, size, lambda: self.rebuild_path(focus, path))
+            if profile != None:
+                profile.printing_time += time.perf_counter()-clock
+        if trace != None:
+            trace.end(n, self.rebuild_path(focus, path))
+        return (self.rebuild_path(focus, path), n)
 
     def __str__(self) -> str:
-        vars = self.get_abstracted_vars()
-        vars.reverse()
-        names = {x.name for x in vars}
-        d = {n:[] for n in names}
-        for v in vars :
-            d[v.name].append(v)
-        # rename
-        for n in d.keys():
-            v = d[n]
-            for i in range(1, len(v)):
-                v[i].name = n+str(i)
-        # get text rep
-        txt = self.to_string()
-
-        # rollback renaming
-        # prevent variables from accumulating numbers
-        for n in d.keys():
-            v = d[n]
-            for i in range(1, len(v)):
-                v[i].name = n
-
-        return txt
+        return self.to_text()
+
+    def to_text(self, context=()) -> str:
+        out = []
+        self.write_text(out, list(context))
+        return "".join(out)
+
+    def write_text(self, out, context) -> None:
+        # Append the text of the term to the list out, in time linear in its
+        # size and without touching the nodes. Binders sharing a name are
+        # numbered by their rank in reverse post-order, loose indices are
+        # named from context (outermost first), which is left as it was.
+        totals = {}
+        ranks = []
+        self.rank_binders(totals, ranks)
+        names = []
+        for name, rank in ranks:
+            i = totals[name]-1-rank
+            names.append(name+str(i) if i > 0 else name)
+        names.reverse()
+        self.to_string(out, context, names)
 
     def is_equals(self, term):
-        linkvar1 = []
-        linkvar2 = []
-        queue1 = []
-        queue2 = []
-        queue1.append(self)
-        queue2.append(term)
+        # alpha equivalence is structural equality over de Bruijn indices,
+        # only binder names can differ between interned nodes
+        queue1 = [self]
+        queue2 = [term]
         while len(queue1) > 0 and len(queue2) > 0:
-            t1 = queue1.pop(0)
-            t2 = queue2.pop(0)
+            t1 = queue1.pop()
+            t2 = queue2.pop()
+            if t1 is t2:
+                continue
+            if t1.hash != t2.hash:
+                return False
             # Not the same type
             if t1.type != t2.type:
                 return False
             # Variable
             if t1.type == TermType.VARIABLE:
-                # 2 linked
-                if t1 in linkvar1 and t2 in linkvar2:
-                    index1 = linkvar1.index(t1)
-                    index2 = linkvar2.index(t2)
-                    if index1 != index2:
-                        return False
+                if t1.index != t2.index:
+                    return False
                 # 2 free
-                elif t1 not in linkvar1 and t2 not in linkvar2:
-                    if t1 != t2:
-                        return False
-                # no match
-                else:
+                if t1.index == None and t1 != t2:
+                    return False
+            # Numeral
+            elif t1.type == TermType.NUMERAL:
+                if t1.value != t2.value:
                     return False
             # Abstract
             elif t1.type == TermType.ABSTRACT:
-                linkvar1.append(t1.var)
-                linkvar2.append(t2.var)
                 queue1.append(t1.right)
                 queue2.append(t2.right)
             # Apply
@@ -172,205 +230,425 @@ class Term:
             return False
         return True
 
-    # Abstract functions
     def copy(self):
-        pass
-    def get_abstracted_vars(self):
-        pass
-    def to_string(self):
-        pass
-    def one_step_beta_reduce(self):
-        pass
-    def one_step_eta_reduce(self):
-        pass
-    def replace(self, var, term):
-        pass
-    def is_var_in(self, var):
-        pass
-    def latex_forest_format(self, beta : bool, highlight_eval = False) -> str:
-        pass
-    def can_beta_reduce(self) -> bool:
-        pass
-    def can_eta_reduce(self) -> bool:
-        pass
-    
-class Abstract(Term):
-    def __init__(self, var, term):
-        super().__init__(None, term, TermType.ABSTRACT)
-        self.var = var
-
-    def copy(self):
-        var = Variable(self.var.name)
-        return Abstract(var, self.right.replace(self.var, var))
-
-    def to_string(self) -> str:
-        txt = '\u03BB'+str(self.var)
-        next = self.right
-        while next.type == TermType.ABSTRACT:
-            txt += f" {next.var}"
-            next = next.right
-        return f"{txt}.{next.to_string()}"
-
-    def replace(self, var, term):
-        if self.var == var:
-            return self.right.replace(var, term)
-        t = self.copy()
-        return Abstract(t.var, t.right.replace(var, term))
+        # terms are immutable, sharing them is safe
+        return self
 
+    # Every traversal below uses an explicit stack, the depth of a term is
+    # only limited by memory.
+
+    def rebuild(self, leaf, depth=0):
+        # Rebuild the tree bottom-up. leaf(t, depth) gives the new subterm
+        # for t or None to go through t, depth counts the crossed binders.
+        # Unchanged subtrees are shared.
+        todo = [(self, depth, False)]
+        results = []
+        while len(todo) > 0:
+            t, depth, done = todo.pop()
+            if done:
+                if t.type == TermType.ABSTRACT:
+                    right = results.pop()
+                    results.append(t if right is t.right else Abstract(t.var, right, True))
+                else:
+                    right = results.pop()
+                    left = results.pop()
+                    results.append(t if left is t.left and right is t.right else Apply(left, right))
+                continue
+            r = leaf(t, depth)
+            if r != None:
+                results.append(r)
+                continue
+            todo.append((t, depth, True))
+            if t.type == TermType.ABSTRACT:
+                todo.append((t.right, depth+1, False))
+            else:
+                todo.append((t.right, depth, False))
+                todo.append((t.left, depth, False))
+        return results[0]
+
+    def bind(self, var, depth):
+        def leaf(t, depth):
+            if not t.named:
+                return t
+            if t.type == TermType.VARIABLE:
+                return Variable(None, depth) if t is var else t
+        return self.rebuild(leaf, depth)
+
+    def shift(self, d, cutoff=0):
+        def leaf(t, cutoff):
+            if t.loose <= cutoff:
+                return t
+            if t.type == TermType.VARIABLE:
+                return Variable(None, t.index+d)
+        return self.rebuild(leaf, cutoff)
+
+    def subst(self, depth, term, cache):
+        # replace the index depth by term and lower the loose indices above
+        def leaf(t, depth):
+            if t.loose <= depth:
+                return t
+            if t.type == TermType.VARIABLE:
+                if t.index == depth:
+                    Term.substituted += 1
+                    if depth not in cache:
+                        cache[depth] = term.shift(depth)
+                    return cache[depth]
+                return Variable(None, t.index-1)
+        return self.rebuild(leaf, depth)
+
+    def has_index(self, index):
+        return (self.free >> index) & 1 == 1
+
+    def rank_binders(self, totals, ranks):
+        # ranks gets a (name, rank) slot per binder in preorder, the rank
+        # being given in post-order
+        todo = [(self, None)]
+        while len(todo) > 0:
+            t, slot = todo.pop()
+            if slot != None:
+                name = t.var.name
+                n = totals.get(name, 0)
+                ranks[slot] = (name, n)
+                totals[name] = n+1
+            elif t.type == TermType.ABSTRACT:
+                todo.append((t, len(ranks)))
+                ranks.append(None)
+                todo.append((t.right, None))
+            elif t.type == TermType.APPLY:
+                todo.append((t.right, None))
+                todo.append((t.left, None))
+
+    def to_string(self, txt, context, names) -> None:
+        # names of the binders are popped in preorder
+        todo = [self]
+        while len(todo) > 0:
+            t = todo.pop()
+            if isinstance(t, str):
+                txt.append(t)
+            elif isinstance(t, int):
+                del context[-t:]
+            elif t.type == TermType.VARIABLE:
+                txt.append(t.name if t.index == None else context[-1-t.index])
+            elif t.type == TermType.NUMERAL:
+                txt.append(str(t.value))
+            elif t.type == TermType.ABSTRACT:
+                name = names.pop()
+                context.append(name)
+                txt.append('λ'+name)
+                next = t.right
+                depth = 1
+                while next.type == TermType.ABSTRACT:
+                    name = names.pop()
+                    context.append(name)
+                    txt.append(f" {name}")
+                    next = next.right
+                    depth += 1
+                txt.append(".")
+                todo.append(depth)
+                todo.append(next)
+            else:
+                # parenthesis around a left abstraction and a right non variable
+                if t.right.type == TermType.VARIABLE or t.right.type == TermType.NUMERAL:
+                    todo.append(t.right)
+                else:
+                    todo.append(")")
+                    todo.append(t.right)
+                    todo.append("(")
+                todo.append(" ")
+                if t.left.type == TermType.ABSTRACT:
+                    todo.append(")")
+                    todo.append(t.left)
+                    todo.append("(")
+                else:
+                    todo.append(t.left)
+
+    def find_redex(self, beta=True, path=None):
+        # leftmost outermost beta (or eta) redex, with the path of
+        # (parent, side, path) from the root to it
+        # an applied numeral is a beta redex once expanded, and 1 is an eta
+        # redex (λf x.f x)
+        ABSTRACT, APPLY, NUMERAL = TermType.ABSTRACT, TermType.APPLY, TermType.NUMERAL
+        todo = [(self, path)]
+        while len(todo) > 0:
+            t, path = todo.pop()
+            # subtrees without redex are skipped
+            if not (t.has_beta if beta else t.has_eta):
+                continue
+            if t.type == APPLY:
+                if beta and (t.left.type == ABSTRACT or t.left.type == NUMERAL):
+                    return t, path
+                todo.append((t.right, (t, 1, path)))
+                todo.append((t.left, (t, 0, path)))
+            elif t.type == ABSTRACT:
+                if not beta and t.is_eta_redex():
+                    return t, path
+                todo.append((t.right, (t, 1, path)))
+            elif t.type == NUMERAL and not beta and t.value == 1:
+                return t, path
+        return None, None
+
+    def locate(self, focus, path, beta):
+        # next redex from the focus of a zipper in preorder: in the focus,
+        # then in the right subtrees met while backing up. Returns the new
+        # focus and path, and whether the focus is a redex (otherwise it is
+        # the whole term).
+        t, p = focus.find_redex(beta, path)
+        if t != None:
+            return t, p, True
+        while path != None:
+            parent, side, path = path
+            focus = self.plug(parent, side, focus)
+            if side == 0 and focus.type == TermType.APPLY:
+                t, p = focus.right.find_redex(beta, (focus, 1, path))
+                if t != None:
+                    return t, p, True
+        return focus, None, False
+
+    def plug(self, parent, side, t):
+        # parent with t in place of its child on side
+        if parent.type == TermType.ABSTRACT:
+            return parent if t is parent.right else Abstract(parent.var, t, True)
+        elif side == 0:
+            return parent if t is parent.left else Apply(t, parent.right)
+        return parent if t is parent.right else Apply(parent.left, t)
+
+    def rebuild_path(self, t, path):
+        # put t back in place of the subterm reached by path
+        while path != None:
+            parent, side, path = path
+            t = self.plug(parent, side, t)
+        return t
 
     def one_step_beta_reduce(self):
-        t = self.copy()
-        r = t.right.one_step_beta_reduce()
-        return (Abstract(t.var, r[0]), True) if r[1] else (None, False)
+        t, path = self.find_redex(True)
+        if t == None:
+            return (None, False)
+        return (self.rebuild_path(t.contract_beta(), path), True)
 
-    def get_abstracted_vars(self):
-        return self.right.get_abstracted_vars()+[self.var]
-    
     def one_step_eta_reduce(self):
-        if self.right.type == TermType.APPLY and self.right.right == self.var and not self.right.left.is_var_in(self.var):
-            return (self.right.left, True)
-        t = self.copy()
-        r = t.right.one_step_eta_reduce()
-        return (Abstract(t.var, r[0]), True) if r[1] else (None, False)
-
-    def is_var_in(self, var):
-        return self.right.is_var_in(var)
-
-    def latex_forest_format(self, beta : bool, highlight_eval = False):
-        if highlight_eval and not beta and self.right.type == TermType.APPLY and self.right.right == self.var and not self.right.left.is_var_in(self.var):
-            box_command = ", tikz={\\node [circle,draw,red,inner sep=0,fit to=tree]{};}"
-            link_command = "{\draw[-,dotted,red] () to (spec var);}"
-            return f"$\lambda {self.var}$, circle, dotted, draw,inner sep=0, red, name=spec var [[{self.right.left.latex_forest_format(False)}] [{self.right.right.latex_forest_format(False)}{box_command}]{link_command}]"
-        else:
-            return f"$\lambda {self.var}$ [{self.right.latex_forest_format(beta, highlight_eval)}]"
-
-    def can_beta_reduce(self):
-        return self.right.can_beta_reduce()
-    
-    def can_eta_reduce(self) -> bool:
-        if self.right.type == TermType.APPLY and self.right.right == self.var and not self.right.left.is_var_in(self.var):
-            return True
-        else:
-            return self.right.can_eta_reduce()
-
-
-class Apply(Term):
-    def __init__(self, left, right):
-        super().__init__(left, right, TermType.APPLY)
-
-    def copy(self):
-        return Apply(self.left.copy(), self.right.copy())
-    
-    def to_string(self) -> str:
-        if (self.left.type == TermType.VARIABLE or self.left.type == TermType.APPLY ) and self.right.type == TermType.VARIABLE:
-            return f"{self.left.to_string()} {self.right.to_string()}"
-        elif self.left.type == TermType.VARIABLE and (self.right.type == TermType.ABSTRACT or  self.right.type == TermType.APPLY):
-            return f"{self.left.to_string()} ({self.right.to_string()})"
-        if self.left.type == TermType.ABSTRACT and self.right.type == TermType.VARIABLE:
-            return f"({self.left.to_string()}) {self.right.to_string()}"
-        elif self.left.type == TermType.ABSTRACT and (self.right.type == TermType.ABSTRACT or  self.right.type == TermType.APPLY):
-            return f"({self.left.to_string()}) ({self.right.to_string()})"
-        elif self.left.type == TermType.APPLY and (self.right.type == TermType.ABSTRACT or  self.right.type == TermType.APPLY):
-            return f"{self.left.to_string()} ({self.right.to_string()})"
+        t, path = self.find_redex(False)
+        if t == None:
+            return (None, False)
+        return (self.rebuild_path(t.contract_eta(), path), True)
+
+    def contract_beta(self):
+        left = self.left if self.left.type == TermType.ABSTRACT else self.left.church()
+        return left.right.subst(0, self.right, {})
+
+    def contract_eta(self):
+        if self.type == TermType.NUMERAL:
+            # λf x.f x, the redex is under the first binder
+            t = self.church()
+            return Abstract(t.var, t.right.contract_eta(), True)
+        return self.right.left.shift(-1)
+
+    def expand_numerals(self):
+        def leaf(t, depth):
+            if t.type == TermType.NUMERAL:
+                return t.church()
+            if t.type == TermType.VARIABLE:
+                return t
+        return self.rebuild(leaf)
 
-    def one_step_eta_reduce(self):
-        r = self.left.one_step_eta_reduce()
-        if r[1]:
-            return (Apply(r[0], self.right), True)
-        else:
-            rr = self.right.one_step_eta_reduce()
-            return (Apply(self.left, rr[0]), rr[1])
-
-    def replace(self, var, term):
-        return Apply(self.left.replace(var, term), self.right.replace(var, term))
-
-    def one_step_beta_reduce(self):
-        if self.left.type == TermType.ABSTRACT:
-            return (self.left.replace(self.left.var, self.right), True)
-        r = self.left.one_step_beta_reduce()
-        if r[1]:
-            return (Apply(r[0], self.right), True)
-        else:
-            rr = self.right.one_step_beta_reduce()
-            return  (Apply(self.left, rr[0]), rr[1])
-
-    def get_abstracted_vars(self):
-        return self.left.get_abstracted_vars() + self.right.get_abstracted_vars()
-
-    def is_var_in(self, var):
-        return self.left.is_var_in(var) or self.right.is_var_in(var)
-
-    def can_beta_reduce(self):
-        if self.left.type == TermType.ABSTRACT:
-            return True
-        elif self.left.can_beta_reduce():
-            return True
-        return self.right.can_beta_reduce()
+    def can_beta_reduce(self) -> bool:
+        return self.has_beta
 
     def can_eta_reduce(self) -> bool:
-        if self.left.can_eta_reduce():
-            return True
-        return self.right.can_eta_reduce()
-
-    def latex_forest_format(self, beta : bool, highlight_eval = False):
-        if highlight_eval and beta:
-            if self.left.type == TermType.ABSTRACT:
-                box_command = ", tikz={\\node [draw,red, inner sep=0,fit to=tree]{};}"
-                if self.right.type == TermType.APPLY:
-                    return f"[{self.left.latex_forest_format(True)}] [{box_command} {self.right.latex_forest_format(True)}]"
-                elif self.right.type == TermType.ABSTRACT:
-                    return f"[{self.left.latex_forest_format(True)}] [$\\lambda {self.right.var}${box_command} [{self.right.right.latex_forest_format(True)}]]"
+        return self.has_eta
+
+    def latex_forest_format(self, beta : bool, highlight_eval = False, context = None, redex = None) -> str:
+        # highlight_eval marks the path down to the next beta (or eta) redex,
+        # given by redex as the sides taken from the root (see latex.sides)
+        # or searched when None
+        if context == None:
+            context = []
+        if highlight_eval and redex == None:
+            t, path = self.find_redex(beta)
+            if t != None:
+                redex = []
+                while path != None:
+                    parent, side, path = path
+                    redex.append(side)
+                redex.reverse()
+        if not highlight_eval:
+            redex = None
+        txt = []
+        # k is the position on the path to the redex, None out of it
+        todo = [(self, 0 if redex != None else None)]
+        while len(todo) > 0:
+            task = todo.pop()
+            if isinstance(task, str):
+                txt.append(task)
+                continue
+            if task == None:
+                context.pop()
+                continue
+            if task[0] == None:
+                context.append(task[1])
+                continue
+            t, k = task
+            at_redex = k != None and k == len(redex)
+            if t.type == TermType.VARIABLE:
+                txt.append(f"${t.name if t.index == None else context[-1-t.index]}$")
+            elif t.type == TermType.NUMERAL:
+                txt.append(f"${t.value}$")
+            elif t.type == TermType.ABSTRACT:
+                context.append(t.var.name)
+                todo.append(None)
+                if at_redex and not beta:
+                    box_command = ", tikz={\\node [circle,draw,red,inner sep=0,fit to=tree]{};}"
+                    link_command = "{\draw[-,dotted,red] () to (spec var);}"
+                    txt.append(f"$\lambda {t.var}$, circle, dotted, draw,inner sep=0, red, name=spec var [[")
+                    todo += [f"{box_command}]{link_command}]", (t.right.right, None), "] [", (t.right.left, None)]
                 else:
-                    return f"[{self.left.latex_forest_format(True)}] [{self.right.latex_forest_format(True)}{box_command}]"
-            elif self.left.can_beta_reduce():
-                return f"[{self.left.latex_forest_format(True, True)}] [{self.right.latex_forest_format(True)}]"
-            else :
-                return f"[{self.left.latex_forest_format(True)}] [{self.right.latex_forest_format(True,True)}]"
-        elif highlight_eval and not beta:
-            if self.left.can_eta_reduce():
-                return f"[{self.left.latex_forest_format(False, True)}] [{self.right.latex_forest_format(False)}]"
-            elif self.right.can_eta_reduce():
-                return f"[{self.left.latex_forest_format(False)}] [{self.right.latex_forest_format(False, True)}]"
+                    txt.append(f"$\lambda {t.var}$ [")
+                    todo += ["]", (t.right, k+1 if k != None and not at_redex else None)]
             else:
-                return f"[{self.left.latex_forest_format(False)}] [{self.right.latex_forest_format(False)}]"
-        else:
-            return f"[{self.left.latex_forest_format(False)}] [{self.right.latex_forest_format(False)}]"
-class Variable(Term):
-    def __init__(self, name):
-        super().__init__(None, None, TermType.VARIABLE)
-        self.name = name
+                left, right = (t.left, None), (t.right, None)
+                if at_redex and beta:
+                    box_command = ", tikz={\\node [draw,red, inner sep=0,fit to=tree]{};}"
+                    if t.right.type == TermType.APPLY:
+                        todo += ["]", right, f"] [{box_command} ", left, "["]
+                    elif t.right.type == TermType.ABSTRACT:
+                        todo += ["]]", None, (t.right.right, None), (None, t.right.var.name), f"] [$\\lambda {t.right.var}${box_command} [", left, "["]
+                    else:
+                        todo += [f"{box_command}]", right, "] [", left, "["]
+                    continue
+                elif k != None and not at_redex:
+                    if redex[k] == 0:
+                        left = (t.left, k+1)
+                    else:
+                        right = (t.right, k+1)
+                todo += ["]", right, "] [", left, "["]
+        return "".join(txt)
 
-    def copy(self):
+class Abstract(Term):
+    __slots__ = ("right", "var", "items")
+    type = TermType.ABSTRACT
+
+    def __new__(cls, var, term, closed = False):
+        # bind the occurrences of the named variable var
+        if not closed and term.named:
+            term = term.bind(var, 0)
+        key = (TermType.ABSTRACT, var.name, term)
+        self = Term.lookup(key)
+        if self is not None:
+            return self
+        self = object.__new__(cls)
+        self.init()
+        self.right = term
+        self.var = var
+        self.items = None
+        self.loose = term.loose-1 if term.loose > 0 else 0
+        self.named = term.named
+        self.size = 1+term.size
+        self.depth = 1+term.depth
+        self.free = term.free >> 1
+        self.has_beta = term.has_beta
+        # λx.t x with x not free in t, as in is_eta_redex
+        self.has_eta = term.has_eta or (term.type == TermType.APPLY and term.right.free == 1 and term.right.type == TermType.VARIABLE and term.left.free & 1 == 0)
+        self.hash = hash((TermType.ABSTRACT, term.hash))
+        Term.table[key] = self
         return self
-    
-    def __str__(self) -> str:
-        return self.name
 
-    def to_string(self):
-        return self.name
+    def is_eta_redex(self):
+        return self.right.type == TermType.APPLY and self.right.right.type == TermType.VARIABLE and self.right.right.index == 0 and not self.right.left.has_index(0)
 
-    def replace(self, var, term):
-        if self == var:
-            return term.copy()
+class Apply(Term):
+    __slots__ = ("left", "right")
+    type = TermType.APPLY
+
+    def __new__(cls, left, right):
+        key = (TermType.APPLY, left, right)
+        self = Term.lookup(key)
+        if self is not None:
+            return self
+        self = object.__new__(cls)
+        self.init()
+        self.left = left
+        self.right = right
+        self.loose = left.loose if left.loose > right.loose else right.loose
+        self.named = left.named or right.named
+        self.size = 1+left.size+right.size
+        self.depth = 1+(left.depth if left.depth > right.depth else right.depth)
+        self.free = left.free | right.free
+        self.has_beta = left.type == TermType.ABSTRACT or left.type == TermType.NUMERAL or left.has_beta or right.has_beta
+        self.has_eta = left.has_eta or right.has_eta
+        self.hash = hash((TermType.APPLY, left.hash, right.hash))
+        Term.table[key] = self
         return self
 
-    def one_step_beta_reduce(self):
-        return (self, False)
-
-    def one_step_eta_reduce(self):
-        return (self, False)
-
-    def get_abstracted_vars(self):
-        return []
-
-    def is_var_in(self, var):
-        return self == var
+class Variable(Term):
+    __slots__ = ("name", "index")
+    type = TermType.VARIABLE
+
+    def __new__(cls, name, index = None):
+        # bound variables only carry their de Bruijn index, the name comes
+        # from the binder
+        if index == None:
+            self = object.__new__(cls)
+            self.init()
+            self.name = name
+            self.index = None
+            self.named = True
+            self.hash = id(self)
+            return self
+        key = (TermType.VARIABLE, index)
+        self = Term.lookup(key)
+        if self is not None:
+            return self
+        self = object.__new__(cls)
+        self.init()
+        self.name = None
+        self.index = index
+        self.loose = index+1
+        self.free = 1 << index
+        self.hash = hash(key)
+        Term.table[key] = self
+        return self
 
-    def latex_forest_format(self, beta:bool, highlight_eval = False):
-        return f"${self.name}$"
+class Numeral(Term):
+    # Church numeral λf x.f (... (f x)) kept as an integer, expanded when it
+    # is applied
+    __slots__ = ("value",)
+    type = TermType.NUMERAL
+
+    def __new__(cls, value):
+        key = (TermType.NUMERAL, value)
+        self = Term.lookup(key)
+        if self is not None:
+            return self
+        self = object.__new__(cls)
+        self.init()
+        self.value = value
+        # 1 is λf x.f x
+        self.has_eta = value == 1
+        self.hash = hash(key)
+        Term.table[key] = self
+        return self
 
-    def can_beta_reduce(self):
-        return False
-    def can_eta_reduce(self) -> bool:
-        return False
-    
+    def church(self):
+        return church(self.value)
+
+def church(n):
+    t = Variable(None, 0)
+    for i in range(n):
+        t = Apply(Variable(None, 1), t)
+    return Abstract(Variable("f"), Abstract(Variable("x"), t, True), True)
+
+def tuple_term(items):
+    # λx.x a1 ... an, the elements go under the tuple binder
+    items = tuple(e.shift(1) for e in items)
+    t = Variable(None, 0)
+    for e in items:
+        t = Apply(t, e)
+    t = Abstract(Variable("x"), t, True)
+    t.items = items
+    return t
+
+def nil():
+    return Abstract(Variable("x"), Abstract(Variable("y"), Variable(None, 0), True), True)
+
+def cons(h, t):
+    # λx y.x h t
+    return Abstract(Variable("x"), Abstract(Variable("y"), Apply(Apply(Variable(None, 1), h.shift(2)), t.shift(2)), True), True)
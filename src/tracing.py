@@ -0,0 +1,92 @@
+import sys
+import term
+
+# Trace of the reduction steps written by the rewriting engine in verbose
+# mode. Only every k-th step, or only the steps changing the size of the
+# term by at least a threshold, can be written, and a compact line shows the
+# contracted redex and its path instead of the whole term (printing the
+# whole term at every step costs more than the reduction). The lines are
+# buffered and written to the console or to a file.
+
+class Trace:
+    def __init__(self, every = 1, size_change = 0, compact = False, path = None, buffer_lines = 1000) -> None:
+        self.every = every
+        self.size_change = size_change
+        self.compact = compact
+        self.path = path
+        self.buffer_lines = buffer_lines
+        self.file = None
+        self.lines = []
+        # size of the term at the last written step
+        self.last_size = None
+        self.last_step = None
+
+    def output(self):
+        if self.path == None:
+            return sys.stdout
+        if self.file == None:
+            self.file = open(self.path, "w")
+        return self.file
+
+    def write(self, line: str) -> None:
+        self.lines.append(line)
+        if len(self.lines) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.lines) > 0:
+            out = self.output()
+            out.write("\n".join(self.lines)+"\n")
+            out.flush()
+            self.lines = []
+
+    def close(self) -> None:
+        self.flush()
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+    def start(self, t: term.Term) -> None:
+        self.last_size = t.size
+        self.last_step = 0
+        self.write(f"0 -> {t}")
+
+    def wanted(self, n, size) -> bool:
+        if n % self.every != 0:
+            return False
+        return abs(size-self.last_size) >= self.size_change
+
+    def step(self, n, beta, redex: term.Term, path, size, result) -> None:
+        # step n contracted redex at the end of path, result() gives the
+        # whole term after it
+        if not self.wanted(n, size):
+            return
+        self.last_size = size
+        self.last_step = n
+        arrow = " -b> " if beta else " -e> "
+        if self.compact:
+            self.write(str(n)+arrow+self.redex_text(redex, path)+f" (size {size})")
+        else:
+            self.write(str(n)+arrow+str(result()))
+
+    def end(self, n, t: term.Term) -> None:
+        # the last term is always shown
+        if self.last_step != n or self.compact:
+            self.write(f"{n} => {t}")
+        self.flush()
+
+    def redex_text(self, redex: term.Term, path) -> str:
+        # position of the redex from the root: 'l' and 'r' for the sides of
+        # an application, '.' for the body of an abstraction
+        sides = []
+        context = []
+        while path != None:
+            parent, side, path = path
+            if parent.type == term.TermType.ABSTRACT:
+                sides.append(".")
+                context.append(parent.var.name)
+            else:
+                sides.append("r" if side == 1 else "l")
+        sides.reverse()
+        context.reverse()
+        return ("".join(sides) if len(sides) > 0 else "root")+": "+redex.to_text(context)